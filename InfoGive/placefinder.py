@@ -1,23 +1,181 @@
-import requests
+import collections
+import json
+import os
+import time
 
+COUNTIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Counties.txt")
 
-def placefinder(lat, lon):
+County = collections.namedtuple("County", ["fips", "name", "state", "phone"])  # phone is None if we don't have one
+
+
+def loadCounties(path=COUNTIES_PATH):
+    """
+    Reads Counties.txt (FIPS code, county, state, health authority phone number or !NONUM) into a dict keyed on FIPS code.
+    """
+    counties = {}
+    with open(path) as f:
+        for line in f:
+            fields = [field.strip() for field in line.split(",")]
+            if len(fields) < 4:
+                continue
+            phone = None if fields[3] == "!NONUM" else fields[3]
+            counties[fields[0]] = County(fields[0], fields[1], fields[2], phone)
+    return counties
+
+
+class FccResolver(object):
+    """
+    Finds the county FIPS code of a coordinate with the FCC's census area API. Needs network access.
+    """
     url = "https://geo.fcc.gov/api/census/area?"
-    place = requests.get(url, params={"lat": lat, "lon": lon})  # In decimal degrees
-    pfacts = place.text.split(",")
-    fips = pfacts[7].split(":")[1].strip('"')
-    f = open("Counties.txt", "r")
-    clist = f.read().split("\n")
-    dlist = []
-    for i in clist:
-        dlist.append(i.split(","))
-    for i in dlist:
-        if i[0] == str(fips):
-            print("It looks like you're in "+i[1]+", "+i[2]+".")
-            if i[3] == "!NONUM":
-                print("Unfortunately we can't seem to find the phone number for your local health authority.")
-            else:
-                print("The phone number for your local health authority is"+i[3]+".")
-
-
-placefinder(34, -111)  # Hard-coded in the coords for Gila, AZ as a test.
+
+    def __init__(self, timeout=10):
+        import requests  # only needed when resolving online
+        self.session = requests.Session()
+        self.timeout = timeout
+
+    def __call__(self, lat, lon):
+        place = self.session.get(self.url, params={"lat": lat, "lon": lon}, timeout=self.timeout)  # In decimal degrees
+        results = place.json().get("results")
+        return results[0]["county_fips"] if results else None
+
+
+class PolygonResolver(object):
+    """
+    Finds the county FIPS code of a coordinate offline, from a local GeoJSON file of county polygons (for example the
+    Census Bureau's cartographic boundary file converted to GeoJSON). Each feature needs a GEOID (or fips) property.
+    Polygons' bounding boxes are bucketed into a grid of cellSize-degree cells, so a lookup only tests the few
+    polygons whose boxes cover the point's cell.
+    """
+
+    def __init__(self, path, cellSize=.5):
+        self.cellSize = cellSize
+        self.polygons = []  # (fips, bounding box, rings); the first ring of each polygon is its outline, the rest holes
+        self.index = collections.defaultdict(list)  # (lat cell, lon cell) -> indices into self.polygons
+        with open(path) as f:
+            features = json.load(f)["features"]
+        for feature in features:
+            properties = feature["properties"]
+            fips = properties.get("GEOID") or properties.get("fips")
+            geometry = feature["geometry"]
+            parts = geometry["coordinates"] if geometry["type"] == "MultiPolygon" else [geometry["coordinates"]]
+            for rings in parts:
+                lons = [point[0] for point in rings[0]]
+                lats = [point[1] for point in rings[0]]
+                box = (min(lats), min(lons), max(lats), max(lons))
+                self.polygons.append((fips, box, rings))
+                for i in range(self._cell(box[0]), self._cell(box[2]) + 1):
+                    for j in range(self._cell(box[1]), self._cell(box[3]) + 1):
+                        self.index[i, j].append(len(self.polygons) - 1)
+
+    def _cell(self, degrees):
+        return int(degrees // self.cellSize)
+
+    @staticmethod
+    def _inside(lat, lon, ring):  # ray casting
+        inside = False
+        j = len(ring) - 1
+        for i in range(len(ring)):
+            loni, lati = ring[i][0], ring[i][1]
+            lonj, latj = ring[j][0], ring[j][1]
+            if (lati > lat) != (latj > lat) and lon < (lonj - loni) * (lat - lati) / (latj - lati) + loni:
+                inside = not inside
+            j = i
+        return inside
+
+    def __call__(self, lat, lon):
+        for k in self.index.get((self._cell(lat), self._cell(lon)), ()):
+            fips, box, rings = self.polygons[k]
+            if box[0] <= lat <= box[2] and box[1] <= lon <= box[3] and self._inside(lat, lon, rings[0]) \
+                    and not any(self._inside(lat, lon, hole) for hole in rings[1:]):
+                return fips
+        return None
+
+
+class PlaceFinder(object):
+    """
+    Looks up the county and health authority for coordinates. Counties.txt is read once, and results are cached
+    (least recently used first out, for at most ttl seconds) on coordinates rounded to precision decimal places,
+    about 100 m by default. Coordinates no county was found for are only cached for negativeTtl seconds, so that a
+    resolver failing for a while doesn't hide a place for the whole ttl. resolver is any function from (lat, lon) to a
+    FIPS code: FccResolver or PolygonResolver.
+    """
+
+    def __init__(self, resolver=None, counties=None, cacheSize=100000, ttl=24 * 60 * 60, negativeTtl=60, precision=3):
+        self.resolver = resolver if resolver is not None else FccResolver()
+        self.counties = counties if counties is not None else loadCounties()
+        self.cacheSize = cacheSize
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self.precision = precision
+        self.cache = collections.OrderedDict()  # rounded (lat, lon) -> (time cached, County or None)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, lat, lon):
+        return round(float(lat), self.precision), round(float(lon), self.precision)
+
+    def _cached(self, key, now):
+        "Whether key has a cached result still in date, and that result."
+        cached = self.cache.get(key)
+        if cached is None or now - cached[0] >= (self.ttl if cached[1] is not None else self.negativeTtl):
+            return False, None
+        self.cache.move_to_end(key)
+        return True, cached[1]
+
+    def _resolve(self, key, now):
+        "Resolve key with the resolver and cache the result."
+        self.misses += 1
+        county = self.counties.get(self.resolver(*key))
+        self.cache[key] = (now, county)
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+        return county
+
+    def lookup(self, lat, lon):
+        "The County containing (lat, lon), or None if it isn't in a county we know of."
+        key = self._key(lat, lon)
+        now = time.monotonic()
+        found, county = self._cached(key, now)
+        if found:
+            self.hits += 1
+            return county
+        return self._resolve(key, now)
+
+    def lookupMany(self, lats, lons):
+        """
+        lookup() for sequences (or arrays) of latitudes and longitudes. Coordinates are rounded and deduplicated first,
+        so each distinct rounded coordinate missing from the cache is resolved once, however often it repeats.
+        """
+        keys = [self._key(lat, lon) for lat, lon in zip(lats, lons)]
+        now = time.monotonic()
+        misses = self.misses
+        results = {}
+        for key in dict.fromkeys(keys):
+            found, county = self._cached(key, now)
+            results[key] = county if found else self._resolve(key, now)
+        self.hits += len(keys) - (self.misses - misses)
+        return [results[key] for key in keys]
+
+
+_finder = None
+
+
+def placefinder(lat, lon):
+    global _finder
+    if _finder is None:
+        _finder = PlaceFinder()
+    county = _finder.lookup(lat, lon)
+    if county is None:
+        print("Unfortunately we can't seem to find which county you're in.")
+        return
+    print("It looks like you're in "+county.name+", "+county.state+".")
+    if county.phone is None:
+        print("Unfortunately we can't seem to find the phone number for your local health authority.")
+    else:
+        print("The phone number for your local health authority is "+county.phone+".")
+
+
+if __name__ == "__main__":
+    placefinder(34, -111)  # Hard-coded in the coords for Gila, AZ as a test.
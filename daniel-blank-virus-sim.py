@@ -1,14 +1,17 @@
+import heapq
+import itertools
 import os
 import random
-import shutil
-import requests
-import math
-from PIL import Image, ImageOps
-from pyproj import Proj, transform
+import numpy as np
+from episim.config import Config
+from episim.density import DensityRaster, humanCounts
+from episim.ensemble import EnsembleResult, runReplicate
+from episim.grid import B_ROTATION, CellGrid
+from episim.profile import NULL_PROFILER, Profiler
+from episim.simulation import Simulation, heatmap
+from episim.snapshots import SnapshotWriter
+from episim.trajectories import TrajectoryStore
 
-# Four of the functions were taken from this guy:  enough that I feel I should give him at least some credit.
-# Author:   Klokan Petr Pridal, klokan at klokan dot cz
-# Web:      http://www.klokan.cz/projects/gdal2tiles/
 
 # Sim parameters
 length_of_sim = 100  # How many timesteps the simulation is.
@@ -21,7 +24,10 @@ lon_step = 90/10800 #how much longitude a cell in the grid covers
 max_lat = min_lat + grid_size * lat_step  # Highest possible latitude
 max_lon = min_lon + grid_size * lon_step  # Highest possible longitude
 density_to_humans = 200 # Conversion factor between population density in the NASA dataset and how many humans the model generates
-db = [] #database of interactions between humans where one was CDC-confirmed infected.
+db = set() #database of interactions between humans where one was CDC-confirmed infected.
+events = [] #heap of (time, sequence number, human, event) for when infected humans' incubation ("incubated") and infection ("resolved") end.
+eventOrder = itertools.count() #keeps events at the same time in the order they were scheduled
+currentTime = 0 #the time the simulation has reached
 transmission_prob_close = .22 #Probability a Bluetooth interaction transmits the virus.
 transmission_prob_far = .01 #Probability a human in the same square catches the virus from a confirmed case.
 quarantine_threshold = .1 #Probability at which a user of the app quarantines themselves, isolating themselves from all other humans.
@@ -35,68 +41,38 @@ fatality_rate = .02 #probability that the virus is lethal
 infection_duration = 14 #Time in days from contagiousness to death/recovery.
 immunity = .77 #Probability of immunity if someone recovers when the duration ends.
 
-#grid setup
-gridA = []
-gridB = []
-riskGrid = []
-
-for i in range(grid_size):
-    gridA.append([])
-    gridB.append([])
-    riskGrid.append([])
-    for j in range(grid_size):
-        gridA[i].append([]) #each cell in the grid is a (possibly empty) list of humans.
-        gridB[i].append([])
-        riskGrid[i].append([0])
-
-"""
-This function finds the chunk, line, and entry where a latitude and longitude occur in the NASA dataset.
-Used to ind the window in which the simulation is set.
-"""
-def LatLonToChunkLineEntry(lat, lon):
-    if lat > 0:
-        if lon > 0:
-            if lon > 90:
-                chunk = 3
-                entry = (lon - 90) // lon_step
-            else:
-                chunk = 2
-                entry = lon // lon_step
-
-        else:
-            if lon > -90:
-                chunk = 1
-                entry = -(-180 - (lon + 90)) // lon_step
-            else:
-                chunk = 0
-                entry = - (-90 - lon) // lon_step
-        line = int((90 - lat) // lat_step)
-
-    else:
-        if lon > 0:
-            if lon > 90:
-                chunk = 7
-                entry = (lon - 90) // lon_step
-            else:
-                chunk = 6
-                entry = lon // lon_step
-        else:
-            if lon > -90:
-                chunk = 5
-                entry = -(-180 - (lon + 90)) // lon_step
-            else:
-                chunk = 4
-                entry = - (-90 - lon) // lon_step
-        line = int(-lat // lat_step)
-    entry = int(entry)
-    return (chunk, line, entry)
-
-
-
-
+engine = "human" # "human" steps one Human object per person; "array" runs the same model on NumPy arrays (see episim/).
+geolife_path = os.environ.get("GEOLIFE_PATH", "C:/Users/Daniel/Downloads/Geolife Trajectories 1.3/Geolife Trajectories 1.3/Data") #path to the data of all humans
+#geolife_path = r"Geolife Trajectories 1.3\Geolife Trajectories 1.3\Data" #path to the data of all humans
+popdensity_path = os.environ.get("POPDENSITY_PATH", "C:/Users/Daniel/Downloads/gpw-v4-population-count-rev11_2020_30_sec_asc")  # path to NASA dataset
+start_time = None # Geolife time (days since 1899-12-30) the simulation starts at. None starts at the first human's first fix.
+density_cache = "gpw-cache" # Line indexes (and, once converted, .npy rasters) of the NASA dataset are kept here.
+seed = None # Seed for the array engine's replicates, to reproduce a run (its seed is printed). None picks a fresh one.
+processes = None # How many processes run array engine replicates at once. None uses every core.
+trajectory_cache = "geolife-cache" # The Geolife data is converted into a binary TrajectoryStore here on the first run, and read from here afterwards.
+snapshot_path = None # If set, each run writes compressed snapshots of its risk grid over time here (see episim/snapshots.py).
+snapshot_interval = 1 # Days between snapshots.
+map_source = "google" # Where the background map comes from: "google" (the Static Maps API), "blank" (a plain graticule, offline), or a directory of z/x/y.png map tiles.
+google_maps_key = "Ask Rhys" # If you don't have a copy of the key already, message me at rhys.a.fenwick@gmail.com.
+map_cache = "map-cache" # Background maps are kept here, so drawing the same box again needs no network access.
+profile_path = None # If set, the time each phase of each timestep takes, and counters of the work done, are written here (.csv or .json).
+profiler = NULL_PROFILER # records nothing unless profile_path is set (see episim/profile.py)
 
+#grid setup
+gridA = CellGrid(grid_size) #each cell in the grid is a (possibly empty) list of humans.
+gridB = CellGrid(grid_size)
+riskGrid = None
 
+def setupGrids(size): # (Re)builds the grids with the given number of squares on a side, so grid_size can be changed at runtime.
+    global grid_size, max_lat, max_lon, riskGrid
+    grid_size = size
+    max_lat = min_lat + grid_size * lat_step
+    max_lon = min_lon + grid_size * lon_step
+    gridA.resize(grid_size)
+    gridB.resize(grid_size)
+    riskGrid = np.zeros((grid_size, grid_size)) # how many timesteps an infected human has spent in each grid A square
 
+setupGrids(grid_size)
 
 """
 This function takes a latitude and longitude, and converts it to two sets of two grid indices, one per grid, which it returns.
@@ -131,42 +107,38 @@ def gridify(lat, lon):
     return ((latIndexA, lonIndexA), (latIndexB, lonIndexB))
 
 """
-A Human. Corresponds to a set of a single person's trajectories in the Geolife dataset.
-Humans can become infected, and step to a time: they move to their position at that time, and their incubation or infection timers decrease, making them die or recover accordingly.
+A Human. Corresponds to a set of a single person's trajectories in the Geolife dataset, given as a Track (arrays of times, latitudes and longitudes) from the TrajectoryStore.
+Humans can become infected, and step to a time: they move to their position at that time. The ends of their incubation and infection are scheduled as events when they are infected (see fireEvents).
 TODO: possibly have humans carry probabilities of infection? How do you implement that, since differing incubation times are a thing?
 """
 class Human(object):
 
-    def __init__(self, filepath=None, gridIndexA=None, gridIndexB = None):
-        self.filepath = filepath
+    def __init__(self, track=None, gridIndexA=None, gridIndexB = None):
+        self.track = track
         self.infected = False #Humans start healthy. TODO: maybe differentiate between those who are infected with CDC codes and those who are exposed and likely to catch the virus?
         self.prob = 0
         self.usingApp = False
-        self.incubationLeft = -1
-        self.infectionLeft = -1
+        self.contagious = False #infected and past incubation
+        self.infectionEnds = None #when the current infection ends in death or recovery
         self.cdcCode = None # Those who are infected and have a CDC code are certain to be infected, rather than simply likely to carry the disease by exposure.
         self.history = [] #history of Bluetooth interactions. Might want to store some other way.
-        if self.filepath != None:
-            self.trajectories = [filepath + "/" + traj for traj in os.listdir(filepath)] #all this human's trajectories
-            self.trajectories.sort() #hopefully the timestamps sort to chronological order
-            self.trajectoryIterator = iter(self.trajectories)
-            self.currTrajectory = open(next(self.trajectoryIterator))
-            for i in range(6):
-                self.currTrajectory.readline()
-            self.posData = self.currTrajectory.readline().split(",")
-            self.lat = float(self.posData[0])
-            self.lon = float(self.posData[1])
-            self.alt = float(self.posData[3])
-            self.time = float(self.posData[4])
+        self.clock = None #the time this human was last stepped to
+        if self.track != None:
+            self.fix = 0 #index of the current fix in the track
+            self.lat = float(self.track.lat[0])
+            self.lon = float(self.track.lon[0])
+            self.time = float(self.track.time[0])
             self.gridIndexA, self.gridIndexB = gridify(self.lat, self.lon)
         else: #stationary human, no trajectories
             self.gridIndexA = gridIndexA
             self.gridIndexB = gridIndexB
             self.time = 0
-        gridA[self.gridIndexA[0]][self.gridIndexA[1]].append(self)
-        gridB[self.gridIndexB[0]][self.gridIndexB[1]].append(self)
+        gridA.add(self, self.gridIndexA)
+        gridB.add(self, self.gridIndexB)
         self.alive = True
         self.immune = False
+        self.wasInfected = False #infected at any point in the run
+        self.dead = False #killed by the virus, as opposed to running out of trajectories
         self.quarantined = False #users of the app quarantine themselves if their probability exceeds a certain threshold.
         self.age = random.normalvariate(37, 15) #Average age 37, stddev age 15. Edit as necessary; will be populated from demographic data if it is present.
 
@@ -174,58 +146,40 @@ class Human(object):
     def stepTo(self, time): #find this person's position at the given time. Time has been discretized, with timestep parameters set globally above.
         if(not self.alive):
             return
-        while(time > self.time):
-            if self.filepath != None:
-                gridA[self.gridIndexA[0]][self.gridIndexA[1]].remove(self)
-                gridB[self.gridIndexB[0]][self.gridIndexB[1]].remove(self)
-                posData = self.currTrajectory.readline()
-                if(posData == ""): #finished this trajectory. Going to next one.
-                    nextTrajectoryPath = next(self.trajectoryIterator, None)
-                    if(nextTrajectoryPath == None):
-                        self.alive = False
-                        return # end of all trajectories. Tentatively, this human simply disappears off the face of the earth.
-                    self.currTrajectory = open(nextTrajectoryPath)
-                    for i in range(6):
-                        self.currTrajectory.readline()
-                    posData = self.currTrajectory.readline()
-                posData = posData.split(",")
-                self.lat = float(posData[0])
-                self.lon = float(posData[1])
-                self.alt = float(posData[3])
-                self.time = float(posData[4])
-                self.posData = posData
+        elapsed = 0 if self.clock == None else time - self.clock # how long since this human was last stepped
+        self.clock = time
+        if self.track != None:
+            if(time > self.time): # jump straight to the first fix at or after time, rather than reading every fix in between
+                self.fix += int(np.searchsorted(self.track.time[self.fix:], time))
+                if(self.fix == len(self.track.time)):
+                    self.alive = False
+                    gridA.remove(self)
+                    gridB.remove(self)
+                    return # end of all trajectories. Tentatively, this human simply disappears off the face of the earth.
+                self.lat = float(self.track.lat[self.fix])
+                self.lon = float(self.track.lon[self.fix])
+                self.time = float(self.track.time[self.fix])
                 self.gridIndexA, self.gridIndexB = gridify(self.lat, self.lon)
-                if(self.gridIndexA[0] not in range(grid_size)):
-                    print(self.gridIndexA)
-                gridA[self.gridIndexA[0]][self.gridIndexA[1]].append(self)
-                gridB[self.gridIndexB[0]][self.gridIndexB[1]].append(self)
-            else:
-                self.time = time
-
-            if(self.infected):
-                riskGrid[self.gridIndexA[0]][self.gridIndexA[1]][0] = riskGrid[self.gridIndexA[0]][self.gridIndexA[1]][0]+1 # This first line increments the risk map every time an infected human is in the grid square
-                if(self.incubationLeft > 0): #assumes timesteps are small enough that overcounting is negligible
-                    self.incubationLeft -= (time - self.time)
-                elif(self.infectionLeft > 0):
-                    self.infectionLeft -= (time - self.time)
-                else:
-                    if random.random() < fatality_rate * self.age/37: #Older people are more likely to die from the virus; here age is just a linear factor; may want to adjust that.
-                        self.alive = False
-                        gridA[self.gridIndexA[0]][self.gridIndexA[1]].remove(self)
-                        gridB[self.gridIndexB[0]][self.gridIndexB[1]].remove(self)
-                        return
-                    if random.random() < immunity:
-                        self.immune = True
-                        self.infected = False
-                        self.prob = 0
-                    else:
-                        self.infected = False
-                        self.prob = 0
-                        self.incubationLeft = -1
-                        self.infectionLeft = -1
-
+                gridA.move(self, self.gridIndexA)
+                gridB.move(self, self.gridIndexB)
+        else:
+            self.time = time
 
+        if(self.infected and elapsed > 0):
+            riskGrid[self.gridIndexA[0], self.gridIndexA[1]] += 1 # This increments the risk map every time an infected human is in the grid square
 
+    def resolve(self): # the infection is over: die or recover.
+        if random.random() < fatality_rate * self.age/37: #Older people are more likely to die from the virus; here age is just a linear factor; may want to adjust that.
+            self.alive = False
+            self.dead = True
+            gridA.remove(self)
+            gridB.remove(self)
+            return
+        if random.random() < immunity:
+            self.immune = True
+        self.infected = False
+        self.contagious = False
+        self.prob = 0
 
 
     def infect(self, cdcCode = None, startTime = None):
@@ -235,218 +189,208 @@ class Human(object):
             pass
             self.prob = 1
             if self.usingApp:
-                db.extend(self.history)
+                db.update(self.history)
                 self.quarantined = True
             # TODO: push history to database; see Bluetooth team
         if(self.alive and not self.infected):
             self.infected = True
-            self.infectionLeft = infection_duration
-            self.incubationLeft = incubation_time
-            if startTime != None:
-                if self.time - startTime < incubation_time:
-                    self.incubationLeft -= (self.time - startTime)
-                else:
-                    self.incubationLeft = 0
-                    self.infectionLeft -= (self.time - startTime - incubation_time)
+            self.wasInfected = True
+            profiler.count("infections", 1)
+            infectedAt = currentTime if startTime == None else startTime # startTime backdates the infection
+            self.infectionEnds = infectedAt + incubation_time + infection_duration
+            heapq.heappush(events, (infectedAt + incubation_time, next(eventOrder), self, "incubated"))
+            heapq.heappush(events, (self.infectionEnds, next(eventOrder), self, "resolved"))
 
 
     def interact(self, other): # log a bluetooth interaction between two humans.
         if self.quarantined or other.quarantined:
             return #quarantined humans are isolated.
-        if self.infected and self.incubationLeft <= 0:
+        if self.infected and self.contagious:
             other.infect()
             #TODO: should we have a separate probability counter marking what app users know of their exposure?
             other.prob += transmission_prob_close * self.prob
             if other.usingApp and self.usingApp and other.prob > quarantine_threshold:
                 other.quarantined = True
-        if other.infected and other.incubationLeft <= 0:
+        if other.infected and other.contagious:
             self.infect()
             self.prob += transmission_prob_close * other.prob
             if other.usingApp and self.usingApp and self.prob > quarantine_threshold:
                 self.quarantined = True
-        if self.infected and self.incubationLeft <= 0: #TODO: should we infect everyone in the square, like I'm doing now, or something else?
-            for h in gridA[self.gridIndexA[0]][self.gridIndexA[1]] + gridB[self.gridIndexB[0]][self.gridIndexB[1]]:
+        if self.infected and self.contagious: #TODO: should we infect everyone in the square, like I'm doing now, or something else?
+            for h in gridA[self.gridIndexA] + gridB[self.gridIndexB]:
                 h.infect()
                 h.prob += transmission_prob_far * self.prob #TODO: do we need those dice rolls then?
         if self.usingApp and other.usingApp:
-            randId = random.randint()
+            randId = random.getrandbits(64)
             self.history.append(randId)
             other.history.append(randId)
 
     def checkForSickness(self):
-        for randId in db:
-            if randId in self.history:
-                self.infect()
-                self.prob += transmission_prob_close #TODO: do we want a global transmission prob?
-                return
-        #TODO: check the database for any random ID in this human's history.
-
-
-def episimulation(n): # Sets up and triggers the simulation n times
-    for i in range(n):
-        #simulation setup
-        basePath = "C:/Users/Daniel/Downloads/Geolife Trajectories 1.3/Geolife Trajectories 1.3/Data" #path to the data of all humans
-        #basePath = r"Geolife Trajectories 1.3\Geolife Trajectories 1.3\Data" #path to the data of all humans
-
-
-        # initially populate gridA with stationary humans.
-        popDensityPath = "C:/Users/Daniel/Downloads/gpw-v4-population-count-rev11_2020_30_sec_asc"  # path to NASA dataset
-        startChunk, startLine, startEntry = LatLonToChunkLineEntry(min_lat, min_lon)
-        popDensityFiles = [popDensityPath + "/" +  filepath for filepath in os.listdir(popDensityPath) if
-                           filepath[len(filepath ) - 4:] == ".asc"]  # find all the asc data in the dataset directory
-        startFile = open(popDensityFiles[startChunk])
-        for i in range(4 + startLine): # skip 4 header lines
-            startFile.readline()
-        for i in range(grid_size):  # currently only supports the whole grid being in one chunk.
-            currLine = startFile.readline()
-            densities = currLine.split(" ")
-            for j in range(startEntry, startEntry + grid_size):
-                numHumans = min(0, int(float(densities[j]) // density_to_humans)) #convert densities to number of humans. Might want a nonlinear function instead.
-                gridIndexA = [i, j - startEntry]
-                gridIndexB = [i, j - startEntry]
-                for k in range(numHumans):
-                    Human(None, gridIndexA, gridIndexB)
-                    if gridIndexB[0] == i:
-                        if gridIndexB[1] == j:
-                            gridIndexB = [i, j + 1]
-                        else:
-                            gridIndexB = [i + 1, j + 1]
-                    else:
-                        if gridIndexB[1] == j:
-                            gridIndexB = [i, j]
-                        else:
-                            gridIndexB = [i + 1, j]
-
-
-        humanPaths = os.listdir(basePath)
-        humans = []
-        for path in humanPaths:
-            humans.append(Human(basePath + "/" + path + "/" + "Trajectory"))
-            humans[len(humans) - 1].stepTo(humans[0].time) #start at the starting time of the first human.
-        currTime = humans[0].time
-        startTime = currTime
-        humans[int(len(humans) * random.random())].infect(42) #infect a human at random, and confirm with a CDC code.
-
-
-
-        #main simulation loop
-        while(currTime < startTime + length_of_sim * timestep_size):
-            currTime += timestep_size
-            [h.stepTo(currTime) for h in humans] #step to a specific time, decrementing timers accordingly
-            for transmitter in humans:
-                if transmitter.infected and transmitter.incubationLeft <= 0: #model spread of the virus to nearby humans
-                    for h in gridA[transmitter.gridIndexA[0]][transmitter.gridIndexA[1]]:
-                        if h != transmitter and random.random() > transmitter.age/200 and random.random() < contact_rate: #Younger people spread the virus more easily. Again, a linear factor on the spread probability, might want something else.
-                            h.interact(transmitter) #TODO: do we want the interactions to happen like this?
-                    for h in gridB[transmitter.gridIndexB[0]][transmitter.gridIndexB[1]] :
-                        if h != transmitter and random.random() > transmitter.age/200 and random.random() < contact_rate:
-                            h.interact(transmitter)
-
+        if not db.isdisjoint(self.history): # a hash lookup per ID in this human's history
+            self.infect()
+            self.prob += transmission_prob_close #TODO: do we want a global transmission prob?
 
-episimulation(1)  # Run the simulation n times, with the cumulative risk going into riskGrid
 
 """
-for row in gridA:
-    print([[h.infected for h in cell] for cell in row])
-print([(h.lat, h.lon) for h in humans])
-# This section outputs a grid showing where everyone (infected or uninfected) is at the end of the sim, with their GPS coordinates.
+Reads the window of the NASA dataset covered by the grid (from whichever chunks it overlaps).
 """
+def densityWindow(popDensityPath):
+    return DensityRaster(popDensityPath, density_cache).gridWindow(config().geometry())
+
+
+def config(): # The parameters above, for the array engine.
+    return Config(length_of_sim=length_of_sim, timestep_size=timestep_size, grid_size=grid_size, min_lat=min_lat,
+                  min_lon=min_lon, lat_step=lat_step, lon_step=lon_step, density_to_humans=density_to_humans,
+                  transmission_prob_close=transmission_prob_close, transmission_prob_far=transmission_prob_far,
+                  quarantine_threshold=quarantine_threshold, contact_rate=contact_rate, incubation_time=incubation_time,
+                  fatality_rate=fatality_rate, infection_duration=infection_duration, immunity=immunity)
+
+
+def placeStationary(counts): # Creates counts[i][j] stationary humans in each grid A square, split evenly among the overlapping grid B squares.
+    stationary = []
+    for i in range(grid_size):
+        for j in range(grid_size):
+            gridIndexA = [i, j]
+            for k in range(counts[i][j]):
+                offset = B_ROTATION[k % 4] # B squares in turn: (i, j), (i, j+1), (i+1, j+1), (i+1, j); the last row and column have no further B square
+                gridIndexB = [min(i + offset[0], grid_size - 1), min(j + offset[1], grid_size - 1)]
+                stationary.append(Human(None, gridIndexA, gridIndexB))
+    return stationary
+
+
+def fireEvents(time): # Ends the incubations and infections due by time, in order, instead of counting down every infected human's timers each step.
+    global currentTime
+    currentTime = time
+    while events and events[0][0] <= time:
+        eventTime, order, h, event = heapq.heappop(events)
+        if not h.alive or not h.infected:
+            continue # died, left the simulation, or recovered early
+        if event == "incubated":
+            h.contagious = True # an incubation always ends before its infection does, so this one is current
+        elif h.infectionEnds == eventTime: # otherwise this event is left over from an earlier infection
+            h.resolve()
+
+
+def simulateHumans(humans, startTime, snapshots=None): # Runs the main simulation loop over a list of Geolife humans, starting at startTime, optionally recording the risk grid into a SnapshotWriter.
+    currTime = startTime
+    fireEvents(currTime)
+    humans[int(len(humans) * random.random())].infect(42) #infect a human at random, and confirm with a CDC code.
+
+    #main simulation loop
+    while(currTime < startTime + length_of_sim * timestep_size):
+        currTime += timestep_size
+        if profiler.enabled:
+            fixes = sum(h.fix for h in humans if h.track != None)
+        with profiler.phase("stepTo"):
+            [h.stepTo(currTime) for h in humans] #step to a specific time
+        if profiler.enabled:
+            profiler.count("humans stepped", len(humans))
+            profiler.count("fixes consumed", sum(h.fix for h in humans if h.track != None) - fixes)
+        with profiler.phase("events"):
+            fireEvents(currTime) #then end any incubations and infections due by now
+        with profiler.phase("contact"):
+            contactLoop(humans)
+        if snapshots != None:
+            with profiler.phase("snapshot"):
+                snapshots.record(currTime, {"risk": riskGrid})
+        profiler.set("db size", len(db))
+        profiler.endStep(currTime)
+
+
+def contactLoop(humans): # Every infectious human meets the humans in their grid squares, spreading the virus.
+    for transmitter in humans:
+        if transmitter.infected and transmitter.contagious: #model spread of the virus to nearby humans
+            profiler.count("contacts evaluated", len(gridA[transmitter.gridIndexA]) + len(gridB[transmitter.gridIndexB]) - 2)
+            for h in gridA[transmitter.gridIndexA]:
+                if h != transmitter and random.random() > transmitter.age/200 and random.random() < contact_rate: #Younger people spread the virus more easily. Again, a linear factor on the spread probability, might want something else.
+                    h.interact(transmitter) #TODO: do we want the interactions to happen like this?
+            for h in gridB[transmitter.gridIndexB] :
+                if h != transmitter and random.random() > transmitter.age/200 and random.random() < contact_rate:
+                    h.interact(transmitter)
+
+
+def mapSource(): # The background map source named by map_source.
+    from episim.basemap import BlankSource, GoogleStaticSource, XyzTileSource # only needed when drawing the map
+    if map_source == "google":
+        return GoogleStaticSource(google_maps_key)
+    if map_source == "blank":
+        return BlankSource()
+    return XyzTileSource(map_source)
+
+
+def profiledEnsemble(simulation, n): # Runs the array engine's n replicates one after another in this process, with the seeds an ensemble would give them, so the profiler records every step of each.
+    sequence = np.random.SeedSequence(seed)
+    outcomes = []
+    for i, replicateSeed in enumerate(sequence.spawn(n)):
+        snapshots = None if snapshot_path == None else SnapshotWriter(os.path.join(snapshot_path, "replicate-%04d" % i), simulation.config.geometry(), snapshot_interval)
+        outcomes.append(runReplicate(simulation.config, simulation.store, simulation.stationaryCounts(), simulation.startTime, replicateSeed, snapshots, profiler))
+        if snapshots != None:
+            snapshots.close()
+    counts = dict((name, np.array([outcome[0][name] for outcome in outcomes])) for name in outcomes[0][0])
+    return EnsembleResult(sequence.entropy, counts, np.array([outcome[1] for outcome in outcomes]))
+
+
+def episimulation(n): # Sets up and triggers the simulation n times
+    global profiler, riskGrid
+    if profile_path != None:
+        profiler = Profiler()
+    #simulation setup
+    with profiler.phase("load"):
+        store = TrajectoryStore.cached(geolife_path, trajectory_cache) # only parses the Geolife text the first time
+        densities = densityWindow(popdensity_path)
+    profiler.endStep(None) # loading gets a row of its own in the trace, before the steps
+
+    if engine == "array": # the n runs are independent replicates, spread over all cores
+        simulation = Simulation(config(), store, densities, start_time)
+        if profile_path == None:
+            ensemble = simulation.ensemble(n, seed, processes, snapshot_path, snapshot_interval)
+        else:
+            ensemble = profiledEnsemble(simulation, n)
+        print("Seed:", ensemble.entropy)
+        for outcome, (mean, quantiles) in ensemble.summary().items():
+            print(outcome, "mean", mean, "5%/50%/95%", quantiles)
+        riskGrid[:] += ensemble.riskGrids.sum(axis=0)
+        return
+
+    counts = humanCounts(densities, density_to_humans) # how many stationary humans stand in each grid A square
+    totalRisk = riskGrid.copy() # each run's risk is added to whatever riskGrid already holds
+    for i in range(n):
+        setupGrids(grid_size) # each run starts with empty grids and risk, no pending events and no recorded interactions
+        events.clear()
+        db.clear()
+        placeStationary(counts) # initially populate the grids with stationary humans.
 
-# This next section finds the highest risk score of any grid square and converts them to log10
-riskiest = 0
-for i in range(grid_size):
-    for j in range(grid_size):
-        if riskGrid[i][j][0] > 0:
-            riskGrid[i][j][0] = math.log10(riskGrid[i][j][0])
-            if riskGrid[i][j][0] > riskiest:
-                riskiest = riskGrid[i][j][0]
-
-# This part linearly scales the risk value from 0 to 255 (for easy colour conversion)
-for i in range(grid_size):
-    for j in range(grid_size):
-        riskGrid[i][j][0] = int(riskGrid[i][j][0]/(riskiest+1)*255)
-
-url = "https://maps.googleapis.com/maps/api/staticmap?"
-# ^Requires center, zoom, and size parameters as as well as an API key.
-# If you don't have a copy of the key already, message me at rhys.a.fenwick@gmail.com.
-
-bbox = [[min_lat, min_lon], [max_lat, max_lon]]  # The lat/long coordinates of the box in order [[bottom, left], [top, right]]
-# Don't forget: negatives mean SW.  I'm sure there's a hot take in there somewhere about hemisphere bias.
-
-coords = [bbox[0], [bbox[0][0], bbox[1][1]], bbox[1], [bbox[1][0], bbox[0][1]]]  # Four corners of the box
-
-originShift = math.pi * 6378137
-initialResolution = 2 * math.pi * 6378137 / 256
-P4326 = Proj("EPSG:4326")
-P3857 = Proj("EPSG:3857")
-
-def LatLonToMeters(lat, lon):
-    "Converts given lat/lon in WGS84 Datum to XY in Spherical Mercator EPSG:900913"
-    x, y = transform(P4326, P3857, lat, lon)
-    return y, x
-
-def MetersToLatLon(y, x):
-    "Converts XY point from Spherical Mercator EPSG:3857 to lat/lon in WGS84 Datum"
-    lat, lon = transform(P3857, P4326, x, y)
-    return lat, lon
-
-def Resolution(zoom):
-    "Resolution (meters/pixel) for given zoom level (measured at Equator)"
-
-    # return (2 * math.pi * 6378137) / (self.tileSize * 2**zoom)
-    return initialResolution / (2 ** zoom)
-
-def MetersToPixels(mx, my, zoom):
-    "Converts EPSG:900913 to pyramid pixel coordinates in given zoom level"
-
-    res = Resolution(zoom)
-    px = (mx + originShift) / res
-    py = (my + originShift) / res
-    return px, py
-
-for i in range(4):
-    coords[i] = LatLonToMeters(coords[i][0], coords[i][1])
-
-print(coords)
-sides = [abs(coords[2][1] - coords[3][1]), abs(coords[1][0] - coords[2][0])]  # Top/Side side lengths in EPSG:3857 Coordinates.  Will always be a rectangle.
-print(sides)
-longest_side = max(sides)  # This determines the zoom level we need
-avlat = (coords[2][0]+coords[1][0])/2
-avlon = (coords[2][1]+coords[3][1])/2
-center_coords = MetersToLatLon(avlat, avlon)  # Center point.  Unfortunately, GMaps needs this back as lat/long.
-center = str(center_coords[0])+","+str(center_coords[1])
-
-zoom = 0  # There's probably a more elegant way to work this out, but I'm lazy and this is the first that comes to mind.
-for i in range(30):
-    if Resolution(i)*640 > longest_side:
-        zoom = i
-
-# Now that we have zoom and center, we can finally grab the map section we want.
-gmap = requests.get(url, params={"size": "640x640", "scale": "2", "zoom": zoom, "center": center, "key": "Ask Rhys"}, stream="True")
-# Note that a 640x640 image at x2 scale returns a 1280x1280 image.  That was a nightmare to figure out.
-mapname = "Initial Map.png"
-with open(mapname, 'wb') as f:
-    shutil.copyfileobj(gmap.raw, f)
-
-# Working out the size and scaling factor of the map section that we care about
-grid_width = sides[0]
-grid_height = sides[1]
-map_size = Resolution(zoom)
-section_height = grid_height/map_size
-section_width = grid_width/map_size
-map_scaling_height = section_height/grid_size
-map_scaling_width = section_width/grid_size
-
-# Graphics time!
-img = Image.new('RGBA', (grid_size,grid_size), color=(255, 255, 255, 0))  # Sets up a grid the size of the simulation
-px = img.load()
-for i in range(grid_size):
-    for j in range(grid_size):
-        if riskGrid[i][j][0] != 0:
-            px[j, i] = ((255, riskGrid[i][j][0], riskGrid[i][j][0], 128))
-img = img.resize(size=(int(2*grid_size*map_scaling_width), int(2*grid_size*map_scaling_height)))
-img = ImageOps.flip(img)  # To account for the fact that the image measures y-values from the top.
-
-background = Image.open("Initial Map.png").convert("RGBA")
-background = ImageOps.fit(background, size=img.size, centering=(0.5, 0.5))
-Image.alpha_composite(background, img).save("Final Heatmap.png")
+        humans = []
+        for user in range(len(store)):
+            humans.append(Human(store.track(user)))
+        startTime = humans[0].time if start_time == None else start_time #start at the starting time of the first human by default.
+        for h in humans:
+            h.stepTo(startTime)
+        if snapshot_path == None:
+            simulateHumans(humans, startTime)
+        else:
+            with SnapshotWriter(os.path.join(snapshot_path, "replicate-%04d" % i), config().geometry(), snapshot_interval) as snapshots:
+                simulateHumans(humans, startTime, snapshots)
+        totalRisk += riskGrid
+    riskGrid = totalRisk
+
+
+if __name__ == "__main__":
+    episimulation(1)  # Run the simulation n times, with the cumulative risk going into riskGrid
+
+    """
+    for i in range(grid_size):
+        print([[h.infected for h in gridA[i, j]] for j in range(grid_size)])
+    print([(h.lat, h.lon) for h in humans])
+    # This section outputs a grid showing where everyone (infected or uninfected) is at the end of the sim, with their GPS coordinates.
+    """
+
+    # The map covering the grid, at the deepest zoom a 640x640 (x2 scale) map allows, from the cache if we've drawn this box before.
+    # Graphics time! Risk is log10-scaled to 0-255, coloured in one pass with north at the top, and laid over the map.
+    with profiler.phase("render"):
+        heatmap(riskGrid, config(), "Final Heatmap.png", mapSource(), map_cache, mapPath="Initial Map.png")
+    if profile_path != None:
+        profiler.endStep(None) # and so does rendering, after them
+        profiler.write(profile_path)
+        for name, total in profiler.summary():
+            print(name, total)
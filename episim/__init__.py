@@ -0,0 +1,6 @@
+"""
+Array-based engine for the GPS epidemic model in daniel-blank-virus-sim.py.
+
+The script keeps one Human object per person; this package keeps the same population in NumPy arrays
+so that each timestep is a handful of batched operations instead of a Python loop over every person.
+"""
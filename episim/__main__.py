@@ -0,0 +1,104 @@
+"""
+Run the array engine headless, without importing the script or any rendering or network libraries unless a heatmap
+is asked for. With --profile, a single replicate runs in this process and the time each phase of each step takes,
+with counters of the work done, is written as a CSV or JSON trace. --checkpoint also runs a single replicate here,
+saving its state every --checkpoint-every steps; --resume carries on from a checkpoint, and with --set (and --seed)
+forks a what-if scenario from it. --snapshots records risk over time in all of these. --tiles runs a single replicate
+split into bands of rows of the grid, each stepped by its own process, for grids too large for one core (and can't
+record snapshots):
+
+    python -m episim --geolife "Geolife Trajectories 1.3/Data" --popdensity gpwv4 --replicates 4 --set contact_rate=.3
+    python -m episim --geolife "Geolife Trajectories 1.3/Data" --checkpoint warm.npz --set length_of_sim=100000
+    python -m episim --resume warm.npz --set quarantine_threshold=.05 --set length_of_sim=200000
+    python -m episim --geolife "Geolife Trajectories 1.3/Data" --popdensity gpwv4 --set grid_size=1000 --tiles 16
+"""
+import argparse
+import os
+
+from episim import checkpoint
+from episim.config import Config
+from episim.profile import NULL_PROFILER, Profiler
+from episim.simulation import Simulation, heatmap
+from episim.snapshots import SnapshotWriter
+
+
+def snapshotWriter(args, config):
+    "A SnapshotWriter for a replicate run in this process, in the directory an ensemble would give replicate 0."
+    if args.snapshots is None:
+        return None
+    return SnapshotWriter(os.path.join(args.snapshots, "replicate-0000"), config.geometry(), args.snapshot_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--geolife", default=os.environ.get("GEOLIFE_PATH"), help="Geolife Data directory ($GEOLIFE_PATH)")
+    parser.add_argument("--popdensity", default=os.environ.get("POPDENSITY_PATH"),
+                        help="NASA GPWv4 .asc directory ($POPDENSITY_PATH); no stationary humans if unset")
+    parser.add_argument("--trajectory-cache", default="geolife-cache")
+    parser.add_argument("--density-cache", default="gpw-cache")
+    parser.add_argument("--start-time", type=float, help="Geolife time (days since 1899-12-30) to start at")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="a Config parameter")
+    parser.add_argument("--replicates", type=int, default=1)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--snapshots", help="directory to write risk snapshots to")
+    parser.add_argument("--snapshot-interval", type=float, default=1., help="days between snapshots")
+    parser.add_argument("--heatmap", help="save the summed risk over a blank map to this image")
+    parser.add_argument("--profile", help="run one replicate here, writing a per-step trace to this .csv or .json file")
+    parser.add_argument("--checkpoint", help="run one replicate here, saving its state to this .npz file")
+    parser.add_argument("--checkpoint-every", type=int, default=1000, help="steps between checkpoints")
+    parser.add_argument("--resume", help="carry on from this checkpoint instead of starting a new run")
+    parser.add_argument("--tiles", type=int, help="run one replicate split into this many processes by rows of the grid")
+    args = parser.parse_args()
+    if args.geolife is None and args.resume is None:
+        parser.error("--geolife (or $GEOLIFE_PATH) is required")
+    if args.tiles is not None and args.snapshots is not None:
+        parser.error("--snapshots can't be taken of a --tiles run")
+
+    config = Config.parse(args.set)
+    profiler = NULL_PROFILER if args.profile is None else Profiler()
+    checkpoints = None if args.checkpoint is None else checkpoint.Checkpointer(args.checkpoint, args.checkpoint_every)
+    with profiler.phase("load"):
+        if args.resume is not None:
+            engine = checkpoint.load(args.resume, seed=args.seed, **vars(config))  # only the parameters given by --set
+            engine.profiler = profiler
+            config = engine.config
+        else:
+            simulation = Simulation.load(config, args.geolife, args.popdensity, args.trajectory_cache,
+                                         args.density_cache, args.start_time)
+    profiler.endStep(None)  # loading gets a row of its own, before the steps
+    if args.resume is not None:
+        snapshots = snapshotWriter(args, config)
+        engine.run(snapshots=snapshots, checkpoints=checkpoints)
+        if snapshots is not None:
+            snapshots.close()
+        print(engine.counts())
+        risk = engine.riskGrid
+    elif args.tiles is not None:
+        counts, risk = simulation.partitioned(args.tiles, args.seed)
+        print(counts)
+    elif args.profile is None and checkpoints is None:
+        ensemble = simulation.ensemble(args.replicates, args.seed, args.processes, args.snapshots, args.snapshot_interval)
+        print("Seed:", ensemble.entropy)
+        for outcome, (mean, quantiles) in ensemble.summary().items():
+            print(outcome, "mean", mean, "5%/50%/95%", quantiles)
+        risk = ensemble.riskGrids.sum(axis=0)
+    else:
+        snapshots = snapshotWriter(args, config)
+        engine = simulation.run(args.seed, snapshots, profiler, checkpoints)
+        if snapshots is not None:
+            snapshots.close()
+        print(engine.counts())
+        risk = engine.riskGrid
+    if args.heatmap:
+        with profiler.phase("render"):
+            heatmap(risk, config, args.heatmap)
+    if args.profile is not None:
+        profiler.endStep(None)  # and so does rendering, after them
+        profiler.write(args.profile)
+        for name, total in profiler.summary():
+            print(name, total)
+
+
+if __name__ == "__main__":
+    main()
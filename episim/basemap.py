@@ -0,0 +1,203 @@
+"""
+Background maps for the risk heatmap.
+
+mapView() works out, from the simulation's bounding box, the Web Mercator centre and zoom of a 640 x 640 map at scale 2
+(1280 x 1280 pixels) covering it, as the Google Static Maps API expects, converting all the corners with one cached
+pyproj Transformer. A map source turns a view into an image: GoogleStaticSource fetches one online, XyzTileSource
+stitches it from a local directory of z/x/y tiles, and BlankSource draws a plain background with a graticule, so
+rendering also works offline. TileCache keeps the images on disk, keyed on (source, bounding box, zoom, size), so
+repeated runs of the same region pay no network cost.
+"""
+import collections
+import hashlib
+import math
+import os
+
+import numpy as np
+
+# The Mercator conversions were taken from gdal2tiles: enough that we should give its author some credit.
+# Author:   Klokan Petr Pridal, klokan at klokan dot cz
+# Web:      http://www.klokan.cz/projects/gdal2tiles/
+EARTH_RADIUS = 6378137
+ORIGIN_SHIFT = math.pi * EARTH_RADIUS
+INITIAL_RESOLUTION = 2 * math.pi * EARTH_RADIUS / 256  # metres per pixel at zoom 0, at the equator
+
+_transformers = {}
+
+
+def transformer(source="EPSG:4326", target="EPSG:3857"):
+    "A pyproj Transformer (longitude/x first), built once per pair of coordinate systems."
+    key = (source, target)
+    if key not in _transformers:
+        from pyproj import Transformer  # only needed for maps
+        _transformers[key] = Transformer.from_crs(source, target, always_xy=True)
+    return _transformers[key]
+
+
+def latLonToMeters(lats, lons):
+    "Web Mercator (x, y) in metres of arrays of latitudes and longitudes, in one batch."
+    return transformer().transform(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+
+
+def metersToLatLon(xs, ys):
+    lons, lats = transformer("EPSG:3857", "EPSG:4326").transform(np.asarray(xs, dtype=np.float64),
+                                                                 np.asarray(ys, dtype=np.float64))
+    return lats, lons
+
+
+def resolution(zoom):
+    "Resolution (meters/pixel) for given zoom level (measured at Equator)"
+    return INITIAL_RESOLUTION / (2 ** zoom)
+
+
+# bbox is ((bottom lat, left lon), (top lat, right lon)); sides are the box's width and height in metres; the map is
+# size x size pixels at scale, centred on centre (lat, lon).
+MapView = collections.namedtuple("MapView", ["bbox", "centre", "zoom", "sides", "size", "scale"])
+
+
+def mapView(bbox, size=640, scale=2):
+    "The centre and the deepest zoom whose size-pixel map still covers bbox."
+    (bottom, left), (top, right) = bbox
+    xs, ys = latLonToMeters([bottom, bottom, top, top], [left, right, right, left])
+    sides = (abs(xs[2] - xs[3]), abs(ys[1] - ys[2]))
+    centreLat, centreLon = metersToLatLon((xs[2] + xs[3]) / 2, (ys[1] + ys[2]) / 2)
+    longest = max(sides)
+    zoom = 0
+    for i in range(30):
+        if resolution(i) * size > longest:
+            zoom = i
+    return MapView(tuple(map(tuple, bbox)), (float(centreLat), float(centreLon)), zoom,
+                   (float(sides[0]), float(sides[1])), size, scale)
+
+
+def overlaySize(view):
+    "The size in pixels (width, height) that the simulated area covers on the view's map."
+    res = resolution(view.zoom)
+    return int(view.scale * view.sides[0] / res), int(view.scale * view.sides[1] / res)
+
+
+def _viewPixels(view):
+    "The view's centre in global pixel coordinates (y down) at the zoom of its scaled pixels, and that zoom."
+    zoom = view.zoom + math.log2(view.scale)
+    x, y = latLonToMeters(view.centre[0], view.centre[1])
+    res = resolution(zoom)
+    return (float(x) + ORIGIN_SHIFT) / res, (ORIGIN_SHIFT - float(y)) / res, zoom
+
+
+class GoogleStaticSource(object):
+    "Maps from the Google Static Maps API. Needs network access and an API key."
+    name = "google"
+    url = "https://maps.googleapis.com/maps/api/staticmap?"
+
+    def __init__(self, key, timeout=30):
+        self.key = key
+        self.timeout = timeout
+
+    def __call__(self, view):
+        import io
+        import requests  # only needed for online maps
+        from PIL import Image
+        centre = str(view.centre[0]) + "," + str(view.centre[1])
+        gmap = requests.get(self.url, params={"size": "%dx%d" % (view.size, view.size), "scale": str(view.scale),
+                                              "zoom": view.zoom, "center": centre, "key": self.key}, timeout=self.timeout)
+        gmap.raise_for_status()
+        # Note that a 640x640 image at x2 scale returns a 1280x1280 image.
+        return Image.open(io.BytesIO(gmap.content)).convert("RGBA")
+
+
+class XyzTileSource(object):
+    """
+    Maps stitched from a local directory of XYZ (slippy map) tiles, such as one downloaded from an OpenStreetMap tile
+    server: path/{z}/{x}/{y}.png. Tiles are read at the zoom whose pixels match the view's scaled pixels; missing tiles
+    are left blank.
+    """
+
+    def __init__(self, path, template="{z}/{x}/{y}.png", tileSize=256, blank=(230, 230, 230, 255)):
+        self.path = path
+        self.template = template
+        self.tileSize = tileSize
+        self.blank = blank
+        self.name = "xyz:" + os.path.abspath(path)
+
+    def __call__(self, view):
+        from PIL import Image
+        width = view.size * view.scale
+        centreX, centreY, zoom = _viewPixels(view)
+        zoom = int(round(zoom))
+        left, top = int(round(centreX - width / 2)), int(round(centreY - width / 2))
+        image = Image.new("RGBA", (width, width), self.blank)
+        tiles = 2 ** zoom
+        for ty in range(top // self.tileSize, (top + width - 1) // self.tileSize + 1):
+            if not 0 <= ty < tiles:
+                continue
+            for tx in range(left // self.tileSize, (left + width - 1) // self.tileSize + 1):
+                tilePath = os.path.join(self.path, self.template.format(z=zoom, x=tx % tiles, y=ty))
+                if not os.path.exists(tilePath):
+                    continue
+                tile = Image.open(tilePath).convert("RGBA")
+                if tile.size != (self.tileSize, self.tileSize):
+                    tile = tile.resize((self.tileSize, self.tileSize))
+                image.paste(tile, (tx * self.tileSize - left, ty * self.tileSize - top))
+        return image
+
+
+class BlankSource(object):
+    "A plain background with lines of latitude and longitude every step degrees (no lines if step is None)."
+
+    def __init__(self, step=.25, background=(240, 240, 235, 255), line=(180, 180, 180, 255)):
+        self.step = step
+        self.background = background
+        self.line = line
+        self.name = "blank:%s:%s:%s" % (step, background, line)
+
+    def __call__(self, view):
+        from PIL import Image, ImageDraw
+        width = view.size * view.scale
+        image = Image.new("RGBA", (width, width), self.background)
+        if self.step is None:
+            return image
+        centreX, centreY, zoom = _viewPixels(view)
+        res = resolution(zoom)
+        left, top = centreX - width / 2, centreY - width / 2
+        edgeLats, edgeLons = metersToLatLon(np.array([left, left + width]) * res - ORIGIN_SHIFT,
+                                            ORIGIN_SHIFT - np.array([top + width, top]) * res)
+        lats = np.arange(math.ceil(edgeLats[0] / self.step), math.floor(edgeLats[1] / self.step) + 1) * self.step
+        lons = np.arange(math.ceil(edgeLons[0] / self.step), math.floor(edgeLons[1] / self.step) + 1) * self.step
+        xs, ys = latLonToMeters(np.concatenate([lats, np.zeros(len(lons))]), np.concatenate([np.zeros(len(lats)), lons]))
+        draw = ImageDraw.Draw(image)
+        for y in (ORIGIN_SHIFT - ys[:len(lats)]) / res - top:
+            draw.line([(0, y), (width, y)], fill=self.line)
+        for x in (xs[len(lats):] + ORIGIN_SHIFT) / res - left:
+            draw.line([(x, 0), (x, width)], fill=self.line)
+        return image
+
+
+class TileCache(object):
+    "Map images on disk in cacheDir, keyed on the source and the view's bounding box, zoom and size."
+
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+
+    def path(self, view, source):
+        key = repr((source.name, view.bbox, view.zoom, view.size, view.scale)).encode()
+        return os.path.join(self.cacheDir, hashlib.sha1(key).hexdigest() + ".png")
+
+    def get(self, view, source):
+        "The view's map from source, read from the cache if it has been fetched before."
+        from PIL import Image
+        path = self.path(view, source)
+        if os.path.exists(path):
+            return Image.open(path).convert("RGBA")
+        image = source(view)
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        image.save(path + ".tmp.png")
+        os.replace(path + ".tmp.png", path)
+        return image
+
+
+def basemap(bbox, source, cacheDir=None, size=640, scale=2):
+    "The map covering bbox from source (through a TileCache in cacheDir, if given), and its MapView."
+    view = mapView(bbox, size, scale)
+    image = source(view) if cacheDir is None else TileCache(cacheDir).get(view, source)
+    return image, view
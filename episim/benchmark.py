@@ -0,0 +1,181 @@
+"""
+Throughput benchmark: runs the script's Human objects and the array engine on the same synthetic Geolife data,
+and reports agents x steps per second for each along with the epidemic statistics they end with. The array engine
+makes every stationary human an agent, which is the model the Human objects follow, so the statistics of the two are
+comparable; where there are stationary humans it also runs with them as cohorts (see episim/cohorts.py), which
+approximate that model.
+
+    python -m episim.benchmark --users 50 --steps 200
+
+--suite runs a fixed set of scenarios instead, with fixed seeds, so results can be compared between versions to catch
+performance regressions; one of them takes its background population from a synthetic GPWv4 .asc raster. --profile
+records per-phase times and counters (see episim/profile.py) for every run, writes them as CSV traces to a directory,
+and adds the phase totals to the results. --out writes the results as JSON.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from episim.config import Config
+from episim.density import DensityRaster, humanCounts as densityHumanCounts
+from episim.engine import ArrayEngine
+from episim.profile import Profiler
+from episim.synthetic import writeGeolife, writeGpw
+from episim.trajectories import TrajectoryStore
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "daniel-blank-virus-sim.py")
+
+
+def loadScript():
+    "Import daniel-blank-virus-sim.py as a module (it only runs the simulation when executed directly)."
+    spec = importlib.util.spec_from_file_location("daniel_blank_virus_sim", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def humanCounts(humans):
+    "Epidemic statistics for Human objects, with the keys and meanings of Population.counts()."
+    return {
+        "humans": len(humans),
+        "cases": sum(h.wasInfected for h in humans),
+        "infected": sum(h.alive and h.infected for h in humans),
+        "immune": sum(h.alive and h.immune for h in humans),
+        "dead": sum(h.dead for h in humans),
+        "departed": sum(not h.alive and not h.dead for h in humans),  # Geolife humans whose trajectories ran out
+        "quarantined": sum(h.alive and h.quarantined for h in humans),
+    }
+
+
+def benchHumans(store, config, background, seed, profiler=None):
+    sim = loadScript()
+    for name, value in config.asDict().items():
+        if hasattr(sim, name):
+            setattr(sim, name, value)
+    sim.setupGrids(config.grid_size)
+    if profiler is not None:
+        sim.profiler = profiler
+    random.seed(seed)
+    start = time.perf_counter()
+    stationary = sim.placeStationary(background.tolist())
+    humans = []
+    for user in range(len(store)):
+        humans.append(sim.Human(store.track(user)))
+    for h in humans:
+        h.stepTo(humans[0].time)
+    setup = time.perf_counter() - start
+    start = time.perf_counter()
+    sim.simulateHumans(humans, humans[0].time)
+    elapsed = time.perf_counter() - start
+    return setup, elapsed, humanCounts(humans + stationary)
+
+
+def benchArrays(store, config, background, seed, profiler=None):
+    start = time.perf_counter()
+    engine = ArrayEngine(config, seed, profiler)
+    engine.populate(store, background)
+    engine.seedInfection()
+    setup = time.perf_counter() - start
+    start = time.perf_counter()
+    counts = engine.run()
+    elapsed = time.perf_counter() - start
+    return setup, elapsed, counts
+
+
+RASTER_CELLSIZE = .5  # degrees; coarse enough that the synthetic GPWv4 chunks are small
+
+# The --suite scenarios: name, keyword arguments of runScenario.
+SUITE = (
+    ("mobile", dict(users=200, steps=200)),
+    ("crowded", dict(users=200, steps=100, background=20)),
+    ("raster", dict(users=100, steps=100, raster=True)),
+)
+
+
+def runScenario(name, users=50, steps=200, background=0, spread=10, raster=False, seed=0, profileDir=None):
+    """
+    Benchmark both engines on users synthetic Geolife users for steps timesteps, with background stationary humans
+    per cell in the block the users move in or, with raster, stationary humans from a synthetic GPWv4 raster.
+    Returns one result dict per engine.
+    """
+    # A short incubation so that the seeded case spreads within a benchmark-sized run.
+    config = Config(length_of_sim=steps, incubation_time=0, infection_duration=steps * Config.timestep_size / 2)
+    if raster:
+        config = config.copy(grid_size=60, lat_step=RASTER_CELLSIZE, lon_step=RASTER_CELLSIZE, density_to_humans=50)
+    geometry = config.geometry()
+    results = []
+    with tempfile.TemporaryDirectory() as tempPath:
+        loading = {}
+        if raster:
+            popDensityPath = writeGpw(os.path.join(tempPath, "gpw"), cellsize=RASTER_CELLSIZE, seed=seed)
+            start = time.perf_counter()
+            densities = DensityRaster(popDensityPath, os.path.join(tempPath, "gpw-cache")).gridWindow(geometry)
+            loading["raster"] = time.perf_counter() - start
+            counts = densityHumanCounts(densities, config.density_to_humans)
+        else:
+            counts = np.zeros((geometry.size, geometry.size), dtype=np.int64)
+            low = (geometry.size - spread) // 2
+            counts[low:low + spread, low:low + spread] = background
+        agents = users + int(counts.sum())
+
+        basePath = writeGeolife(os.path.join(tempPath, "Data"), geometry, users=users, fixes=steps, spread=spread,
+                                seed=seed)
+        start = time.perf_counter()
+        store = TrajectoryStore.ingest(basePath, os.path.join(tempPath, "store"))
+        loading["ingest"] = time.perf_counter() - start
+        print("%-8s %s  %d fixes, %d agents" % (name, "  ".join("%s %7.3fs" % item for item in sorted(loading.items())),
+                                                len(store.time), agents))
+        engines = [("human", benchHumans, config), ("array", benchArrays, config.copy(background="agents"))]
+        if counts.any():
+            engines.append(("cohorts", benchArrays, config.copy(background="cohorts")))
+        for engine, bench, engineConfig in engines:
+            profiler = Profiler() if profileDir is not None else None
+            setup, elapsed, outcome = bench(store, engineConfig, counts, seed, profiler)
+            result = {"scenario": name, "engine": engine, "agents": agents, "steps": steps, "load": loading,
+                      "setup": setup, "run": elapsed, "agentStepsPerSecond": agents * steps / elapsed, "counts": outcome}
+            print("%-8s %-7s setup %7.3fs  run %7.3fs  %12.0f agent-steps/s  %s"
+                  % (name, engine, setup, elapsed, result["agentStepsPerSecond"], outcome))
+            if profiler is not None:
+                profiler.toCsv(os.path.join(profileDir, "%s-%s.csv" % (name, engine)))
+                result["phases"] = profiler.totals
+                print("%17s %s" % ("", ", ".join("%s %.4g" % item for item in profiler.summary())))
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="synthetic Geolife users")
+    parser.add_argument("--steps", type=int, default=200, help="timesteps to simulate")
+    parser.add_argument("--background", type=int, default=0, help="stationary humans per cell in the populated block")
+    parser.add_argument("--spread", type=int, default=10, help="side, in cells, of the block the users move in")
+    parser.add_argument("--raster", action="store_true", help="take stationary humans from a synthetic .asc raster")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--suite", action="store_true", help="run the fixed benchmark scenarios")
+    parser.add_argument("--profile", metavar="DIR", help="write per-step phase traces here")
+    parser.add_argument("--out", help="write the results here as JSON")
+    args = parser.parse_args()
+
+    if args.profile is not None and not os.path.isdir(args.profile):
+        os.makedirs(args.profile)
+    if args.suite:
+        scenarios = SUITE
+    else:
+        scenarios = (("custom", dict(users=args.users, steps=args.steps, background=args.background,
+                                     spread=args.spread, raster=args.raster)),)
+    results = []
+    for name, params in scenarios:
+        results.extend(runScenario(name, seed=args.seed, profileDir=args.profile, **params))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Checkpoints of the array engine's full state, to pause and resume long runs and to fork what-if scenarios from one
+warmed-up state.
+
+A checkpoint is one uncompressed .npz file of plain arrays: every Population and Cohorts array, each mobile human's
+cursor into the TrajectoryStore, the risk grid, the exposure log and database, the pending disease progression events
+and the time, plus a JSON header holding the Config, the random generator's state and the store's fingerprint. Nothing
+is pickled, so saving costs about as much as copying the arrays, and a resumed run continues bit for bit as the
+original would have.
+"""
+import json
+import os
+
+import numpy as np
+
+from episim.cohorts import Cohorts
+from episim.config import Config
+from episim.engine import ArrayEngine
+from episim.exposure import TOKEN_DTYPE
+from episim.population import Population
+from episim.trajectories import TrajectoryStore
+
+VERSION = 1
+
+# Parameters a fork can't change: they shape the state itself rather than what happens next.
+FIXED_PARAMETERS = ("grid_size", "min_lat", "min_lon", "lat_step", "lon_step", "background")
+
+
+def _arrays(obj, prefix):
+    "Every array attribute of obj, named prefix + attribute."
+    return dict((prefix + name, value) for name, value in vars(obj).items() if isinstance(value, np.ndarray))
+
+
+def save(engine, path):
+    "Write engine's state to path (an .npz file), replacing it atomically."
+    pop = engine.population
+    arrays = _arrays(pop, "population.")
+    if engine.cohorts is not None:
+        arrays.update(_arrays(engine.cohorts, "cohorts."))
+    heap = sorted(pop.events.heap, key=lambda event: event[:2])
+    arrays["events.time"] = np.array([event[0] for event in heap], dtype=np.float64)
+    arrays["events.sequence"] = np.array([event[1] for event in heap], dtype=np.int64)
+    arrays["events.kind"] = np.array([event[2] for event in heap], dtype=np.int64)
+    arrays["events.offsets"] = np.cumsum([0] + [len(event[3]) for event in heap])
+    arrays["events.agents"] = np.concatenate([event[3] for event in heap]) if heap else np.zeros(0, dtype=np.int64)
+    arrays["fix"] = engine.fix
+    arrays["lastFix"] = engine.lastFix
+    arrays["riskGrid"] = engine.riskGrid
+    arrays["exposures.owner"] = engine.exposures.owner[:engine.exposures.size]
+    arrays["exposures.token"] = engine.exposures.token[:engine.exposures.size]
+    database = engine.database
+    arrays["database.tokens"] = database.tokens
+    arrays["database.pending"] = np.concatenate(database.pending) if database.pending else np.zeros(0, dtype=TOKEN_DTYPE)
+    header = {
+        "version": VERSION,
+        "config": engine.config.asDict(),
+        "time": engine.time,
+        "steps": engine.steps,
+        "cases": engine.cases,
+        "populationTime": pop.time,
+        "eventSequence": pop.events.sequence,
+        "nextId": pop.nextId,
+        "rng": engine.rng.bit_generator.state,
+        "store": os.path.abspath(engine.store.path),
+        "storeFingerprint": engine.store.manifest.get("fingerprint"),
+    }
+    arrays["header"] = np.array(json.dumps(header))
+    temporary = path + ".tmp.npz"
+    np.savez(temporary, **arrays)
+    os.replace(temporary, path)
+
+
+def load(path, store=None, seed=None, **changes):
+    """
+    An ArrayEngine in the state saved at path. store is the TrajectoryStore the run used, by default opened from the
+    path recorded in the checkpoint; it must hold the same data. With changes (Config parameters) the engine is a fork:
+    it carries on from the saved state under different parameters, except that ages stay as they were drawn. A seed
+    gives the fork its own random numbers; otherwise it continues the saved run's.
+    """
+    with np.load(path) as saved:
+        arrays = dict((name, saved[name]) for name in saved.files)
+    header = json.loads(str(arrays.pop("header")))
+    if header["version"] != VERSION:
+        raise ValueError("Unsupported checkpoint version %r" % header["version"])
+    fixed = [name for name in FIXED_PARAMETERS if name in changes and changes[name] != header["config"][name]]
+    if fixed:
+        raise ValueError("A fork can't change " + ", ".join(fixed))
+    params = dict(header["config"])
+    params.update(changes)
+    config = Config(**params)
+    if store is None:
+        store = TrajectoryStore(header["store"])
+    if store.manifest.get("fingerprint") != header["storeFingerprint"]:
+        raise ValueError("The trajectory store has changed since the checkpoint was saved")
+
+    engine = ArrayEngine(config)
+    engine.store = store
+    engine.time = header["time"]
+    engine.steps = header["steps"]
+    engine.cases = header["cases"]
+    engine.fix = arrays.pop("fix")
+    engine.lastFix = arrays.pop("lastFix")
+    engine.riskGrid = arrays.pop("riskGrid")
+
+    pop = engine.population = Population(len(arrays["population.alive"]), config, engine.rng)
+    pop.time = header["populationTime"]
+    if "cohorts.S" in arrays:
+        engine.cohorts = Cohorts(np.zeros(engine.geometry.cells, dtype=np.int64), engine.geometry, config, engine.rng)
+    for name in list(arrays):
+        owner, _, attribute = name.partition(".")
+        if owner == "population":
+            setattr(pop, attribute, arrays.pop(name))
+        elif owner == "cohorts":
+            setattr(engine.cohorts, attribute, arrays.pop(name))
+
+    offsets = arrays["events.offsets"]
+    pop.events.heap = [(float(arrays["events.time"][k]), int(arrays["events.sequence"][k]), int(arrays["events.kind"][k]),
+                        arrays["events.agents"][offsets[k]:offsets[k + 1]]) for k in range(len(offsets) - 1)]
+    pop.events.sequence = header["eventSequence"]  # the heap was saved sorted, so it is already a valid heap
+    pop.nextId = header.get("nextId", pop.size)  # older checkpoints' humans were never added to, so ids were indices
+
+    owners = arrays["exposures.owner"]
+    engine.exposures.owner = owners.copy()
+    engine.exposures.token = arrays["exposures.token"].copy()
+    engine.exposures.size = len(owners)
+    engine.database.tokens = arrays["database.tokens"]
+    pending = arrays["database.pending"]
+    engine.database.pending = [pending] if len(pending) else []
+
+    # The generator is shared by the engine, population and cohorts, and set last: building them above drew from it.
+    if seed is None:
+        engine.rng.bit_generator.state = header["rng"]
+    else:
+        engine.rng.bit_generator.state = np.random.default_rng(seed).bit_generator.state
+    if config.app_adoption != header["config"]["app_adoption"]:
+        pop.usingApp = engine.rng.random(pop.size) < config.app_adoption  # who uses the app is drawn again
+    return engine
+
+
+class Checkpointer(object):
+    "Saves an engine to path every `every` steps; give it to ArrayEngine.run()."
+
+    def __init__(self, path, every=1000):
+        self.path = path
+        self.every = every
+
+    def stepped(self, engine):
+        if engine.steps % self.every == 0:
+            save(engine, self.path)
@@ -0,0 +1,154 @@
+"""
+Background population as compartment counts. Stationary NASA humans never move, so instead of one agent each they are
+kept as counts of Susceptible, Exposed (incubating), Infectious, Recovered (immune) and Dead humans per age band, for
+every (grid A cell, grid B quadrant) unit: memory scales with the number of populated cells, not of people.
+
+Counts are updated with binomial draws. Leaving incubation and leaving infection happen at a constant rate per step
+(1 / incubation_time and 1 / infection_duration), which keeps the average durations of the per-human timers. Unlike
+agents, Recovered humans are out of the epidemic: they can't be infected again.
+"""
+import math
+
+import numpy as np
+
+from episim.contact import cellIndex, contactRates
+
+AGE_BANDS = (0, 20, 40, 60, 80)  # lower edges of the age bands, in years; the first band also takes anyone younger
+COMPARTMENTS = ("S", "E", "I", "R", "D")
+
+
+def bandAges(config):
+    """
+    The share of humans in each age band and the band's mean age, for ages drawn from the normal distribution
+    every agent's age is drawn from.
+    """
+    edges = [-math.inf] + list(AGE_BANDS[1:]) + [math.inf]
+    mean, stddev = config.age_mean, config.age_stddev
+    z = [(edge - mean) / stddev for edge in edges]
+    cdf = [.5 * (1 + math.erf(x / math.sqrt(2))) for x in z]
+    pdf = [0 if math.isinf(x) else math.exp(-x * x / 2) / math.sqrt(2 * math.pi) for x in z]
+    weights = np.diff(cdf)
+    ages = np.array([mean + stddev * (pdf[b] - pdf[b + 1]) / max(weights[b], 1e-300) for b in range(len(weights))])
+    return weights / weights.sum(), ages
+
+
+def rate(dt, duration):
+    """
+    Probability per step of leaving a stage that lasts duration days on average: stages end at a constant rate, so
+    the chance over dt is the same whether it is taken in one step or many.
+    """
+    return 1.0 if duration <= 0 else -np.expm1(-dt / duration)
+
+
+class Cohorts(object):
+
+    def __init__(self, stationaryCounts, geometry, config, rng):
+        self.geometry = geometry
+        self.config = config
+        self.rng = rng
+        counts = np.asarray(stationaryCounts, dtype=np.int64).ravel()
+        cells = np.flatnonzero(counts)
+        quadrant = np.tile(np.arange(4), len(cells))
+        cellA = np.repeat(cells, 4)
+        size = counts[cellA] // 4 + (quadrant < counts[cellA] % 4)  # the same split as rotating humans through the B cells
+        keep = size > 0
+        self.cellA = cellA[keep]
+        self.cellB = geometry.rotateB(self.cellA, quadrant[keep])
+        weights, self.ages = bandAges(config)
+        self.S = rng.multinomial(size[keep], weights)
+        for compartment in COMPARTMENTS[1:]:
+            setattr(self, compartment, np.zeros_like(self.S))
+        self.prob = np.zeros(len(self.cellA))  # mean probability of actually having the virus among each unit's infected
+        self.naive = self.S.copy()  # susceptible humans never infected; the rest of S recovered without immunity
+        self.wasInfected = np.zeros(len(self.cellA), dtype=np.int64)  # humans of each unit infected at any point in the run
+
+    def __len__(self):
+        return len(self.cellA)
+
+    def rates(self):
+        return contactRates(self.ages, self.config.contact_rate)
+
+    def transmitterTotals(self, cells):
+        """
+        Infectious humans of the units that have any, in one grid (cells is self.cellA or self.cellB): the units' cells,
+        and their count, summed rates and summed rate x prob, as a CellKernel's background.
+        """
+        count = self.I.sum(1)
+        units = np.flatnonzero(count)
+        rateSum = self.I[units] @ self.rates()
+        return cells[units], count[units], rateSum, rateSum * self.prob[units]
+
+    def _addInfected(self, newly, prob):
+        "Move newly (units x bands) humans from S to E, with the given infection probability."
+        total = (self.E + self.I).sum(1)
+        added = newly.sum(1)
+        some = added > 0
+        self.prob[some] = (self.prob[some] * total[some] + prob[some] * added[some]) / (total[some] + added[some])
+        # Humans infected again are only counted once, as for agents: draw how many of newly were never infected.
+        units, bands = np.nonzero(newly)
+        naive = self.naive[units, bands]
+        first = self.rng.hypergeometric(naive, self.S[units, bands] - naive, newly[units, bands])
+        self.naive[units, bands] -= first
+        self.wasInfected += np.bincount(units, weights=first, minlength=len(self)).astype(np.int64)
+        self.S -= newly
+        self.E += newly
+
+    def expose(self, kernels):
+        """
+        Draw this step's infections of susceptible humans by the infectious humans (agents and cohorts) counted in the
+        CellKernels of grid A and grid B. Returns the A and B cells in which an infectious background human was met by
+        another infectious human, which (as for agents) infects everyone in the cell.
+        """
+        config = self.config
+        escape = np.ones(len(self))  # chance a susceptible human in the unit meets no infectious human
+        escapeInfectious = np.ones(len(self))  # the same for an infectious one, who can't meet itself
+        received = np.zeros(len(self))
+        for kernel, cells in zip(kernels, (self.cellA, self.cellB)):
+            slots = kernel.slotsOf(cells)
+            count = kernel.count[slots]
+            rateSum = kernel.rateTotal[slots]
+            mean = np.where(count > 0, rateSum / np.maximum(count, 1), 0)
+            escape *= (1 - mean) ** count
+            escapeInfectious *= (1 - mean) ** np.maximum(count - 1, 0)
+            received += np.where(rateSum > 0, kernel.rateProbTotal[slots] / np.where(rateSum > 0, rateSum, 1), 0)
+        newly = self.rng.binomial(self.S, (1 - escape)[:, None])
+        self._addInfected(newly, config.transmission_prob_close * received)
+        met = self.rng.binomial(self.I.sum(1), 1 - escapeInfectious) > 0
+        return self.cellA[met], self.cellB[met]
+
+    def infectCells(self, cellsA, cellsB, prob=0):
+        "Infect every susceptible human in units whose A cell is in cellsA or whose B cell is in cellsB (sorted cells)."
+        units = cellIndex(cellsA, self.cellA)[1] | cellIndex(cellsB, self.cellB)[1]
+        newly = np.where(units[:, None], self.S, 0)
+        self._addInfected(newly, np.full(len(self), prob))
+
+    def progress(self, dt, riskGrid):
+        "One timestep of disease progression for the units with infected humans, adding those humans to the risk grid."
+        config = self.config
+        infected = (self.E + self.I).sum(1)
+        units = np.flatnonzero(infected)
+        np.add.at(riskGrid.ravel(), self.cellA[units], infected[units])
+        E = self.E[units]
+        I = self.I[units]
+        infectious = self.rng.binomial(E, rate(dt, config.incubation_time))
+        done = self.rng.binomial(I, rate(dt, config.infection_duration))
+        self.E[units] = E - infectious
+        self.I[units] = I + infectious - done
+        # Older people are more likely to die from the virus; age is a linear factor, as for agents.
+        dead = self.rng.binomial(done, np.clip(config.fatality_rate * self.ages / config.age_mean, 0, 1))
+        immune = self.rng.binomial(done - dead, config.immunity)
+        self.D[units] += dead
+        self.R[units] += immune
+        self.S[units] += done - dead - immune
+
+    def counts(self):
+        "Epidemic statistics, with the same keys as Population.counts()."
+        return {
+            "humans": int(sum(getattr(self, compartment).sum() for compartment in COMPARTMENTS)),
+            "cases": int(self.wasInfected.sum()),
+            "infected": int((self.E + self.I).sum()),
+            "immune": int(self.R.sum()),
+            "dead": int(self.D.sum()),
+            "departed": 0,
+            "quarantined": 0,
+        }
@@ -0,0 +1,76 @@
+"""
+Simulation and virus parameters. The defaults are the values used by daniel-blank-virus-sim.py; see the README for what each one means.
+"""
+from episim.grid import GridGeometry
+
+
+def _number(value):
+    number = float(value)
+    return int(number) if number.is_integer() and "." not in value else number
+
+
+class Config(object):
+    # Sim parameters
+    length_of_sim = 100  # How many timesteps the simulation is.
+    timestep_size = .00001157  # How long each timestep is, in days (here, a second)
+    grid_size = 300  # How many squares on a side the grid has.
+    min_lat = 39  # Lowest possible latitude
+    min_lon = 116  # Lowest possible longitude
+    lat_step = 90/10800  # how much latitude a cell in the grid covers. Fixed by the NASA dataset.
+    lon_step = 90/10800  # how much longitude a cell in the grid covers
+    density_to_humans = 200  # Conversion factor between population density in the NASA dataset and how many humans the model generates
+    transmission_prob_close = .22  # Probability a Bluetooth interaction transmits the virus.
+    transmission_prob_far = .01  # Probability a human in the same square catches the virus from a confirmed case.
+    quarantine_threshold = .1  # Probability at which a user of the app quarantines themselves.
+    contact_rate = .2  # Probability that a human comes in contact with another if they are both in the same square.
+    app_adoption = 0  # Fraction of humans using the app.
+    confirmation_rate = 0  # Chance per day that an infectious human is tested and confirmed (gets a CDC code).
+    background = "cohorts"  # "cohorts" keeps stationary NASA humans as per-cell counts (see cohorts.py); "agents" makes each one an agent.
+
+    # Virus parameters
+    incubation_time = 14  # Time in days from infection to contagiousness.
+    fatality_rate = .02  # probability that the virus is lethal
+    infection_duration = 14  # Time in days from contagiousness to death/recovery.
+    immunity = .77  # Probability of immunity if someone recovers when the duration ends.
+    age_mean = 37  # Humans' ages are drawn from a normal distribution with this mean...
+    age_stddev = 15  # ...and this standard deviation.
+
+    def __init__(self, **params):
+        for name, value in params.items():
+            if name.startswith("_") or not hasattr(Config, name) or callable(getattr(Config, name)):
+                raise TypeError("Unknown simulation parameter: " + name)
+            setattr(self, name, value)
+
+    @classmethod
+    def parameterNames(cls):
+        return sorted(name for name, value in vars(Config).items() if not name.startswith("_") and not callable(value)
+                      and not isinstance(value, classmethod))
+
+    @classmethod
+    def parse(cls, assignments):
+        "A Config from \"name=value\" strings, each value converted to the type of the parameter's default."
+        params = {}
+        for assignment in assignments:
+            name, _, value = assignment.partition("=")
+            name = name.strip()
+            if name not in cls.parameterNames():
+                raise TypeError("Unknown simulation parameter: " + name)
+            default = getattr(Config, name)
+            params[name] = value.strip() if isinstance(default, str) else float(value) if isinstance(default, float) else \
+                _number(value)
+        return Config(**params)
+
+    def asDict(self):
+        return dict((name, getattr(self, name)) for name in self.parameterNames())
+
+    def copy(self, **changes):
+        params = self.asDict()
+        params.update(changes)
+        return Config(**params)
+
+    def geometry(self):
+        return GridGeometry(self.min_lat, self.min_lon, self.lat_step, self.lon_step, self.grid_size)
+
+    def __repr__(self):
+        changed = ["%s=%r" % (name, value) for name, value in sorted(vars(self).items())]
+        return "Config(" + ", ".join(changed) + ")"
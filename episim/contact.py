@@ -0,0 +1,183 @@
+"""
+Cell-level contact kernel. Instead of drawing every (transmitter, cellmate) pair, infectious humans are tallied per cell
+and each human in a cell draws how many of them it met from one binomial, so a step costs time proportional to how many
+humans there are rather than to the square of how many share a cell. Tallies are only kept for the cells that hold
+infectious humans, sorted so that humans find their cell's tallies by binary search: nothing scales with the number of
+cells in the grid.
+
+A transmitter meets each cellmate with probability contactRates() (the two dice of episimulation's contact loop).
+Within a cell, transmitters' rates are replaced by their mean, which keeps the expected number of contacts exact.
+"""
+import numpy as np
+
+
+def contactRates(age, contactRate):
+    "Per-human probability of coming into contact with a given cellmate. Younger people spread the virus more easily."
+    return np.clip(1 - age / 200, 0, 1) * contactRate
+
+
+def cellIndex(keys, cells):
+    """
+    Where each of cells is in keys, a sorted array of distinct cells: (slot, found). slot is only meaningful where
+    found is true.
+    """
+    if len(keys) == 0:
+        return np.zeros(len(cells), dtype=np.int64), np.zeros(len(cells), dtype=bool)
+    slot = np.minimum(np.searchsorted(keys, cells), len(keys) - 1)
+    return slot, keys[slot] == cells
+
+
+def cellValues(keys, values, cells):
+    "The values (one per cell of keys, a sorted array of distinct cells) at each of cells, or 0 where there are none."
+    slot, found = cellIndex(keys, cells)
+    return np.where(found, values[slot], 0) if len(keys) else np.zeros(len(cells))
+
+
+def sumByCell(cells, values):
+    """
+    Sum a stack of values (k x len(cells)) by cell. Returns (keys, sums): the sorted distinct cells and their k x
+    len(keys) sums.
+    """
+    keys, inverse = np.unique(cells, return_inverse=True)
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    sums = np.zeros((len(values), len(keys)))
+    for k, row in enumerate(values):
+        sums[k] = np.bincount(inverse, weights=row, minlength=len(keys))
+    return keys, sums
+
+
+class CellKernel(object):
+    """
+    Infectious humans in one grid (A or B), tallied per cell separately for app users and everyone else.
+    Contacts between two app users exchange Bluetooth IDs, so those are drawn pair by pair (app transmitters are also
+    kept sorted by cell for that); every other contact is drawn from the per-cell tallies.
+
+    occupied is the sorted array of cells holding infectious humans, and tallies the 6 x len(occupied) array of each
+    group's (app users, then everyone else) count, summed rates and summed rate x prob in those cells.
+    """
+
+    def __init__(self, cells, transmitters, rates, prob, usingApp, background=None):
+        """
+        cells, transmitters, rates, prob and usingApp are per-agent arrays. background optionally adds infectious
+        humans who aren't agents (Cohorts.transmitterTotals): the cells of groups of them, and each group's count,
+        summed rates and summed rate x prob.
+        """
+        self.cells = cells
+        self.transmitters = transmitters
+        self.rates = rates
+        self.prob = prob
+        self.usingApp = usingApp
+        self.inGroups = (usingApp, ~usingApp)
+        where = []
+        tallies = []
+        for k, inGroup in enumerate(self.inGroups):
+            members = np.flatnonzero(transmitters & inGroup)
+            tally = np.zeros((6, len(members)))
+            tally[3 * k] = 1
+            tally[3 * k + 1] = rates[members]
+            tally[3 * k + 2] = rates[members] * prob[members]
+            where.append(cells[members])
+            tallies.append(tally)
+        if background is not None:  # background humans don't use the app
+            backgroundCells, count, rate, rateProb = background
+            tally = np.zeros((6, len(backgroundCells)))
+            tally[3:] = np.array([count, rate, rateProb], dtype=np.float64)
+            where.append(backgroundCells)
+            tallies.append(tally)
+        self.occupied, self.tallies = sumByCell(np.concatenate(where), np.hstack(tallies))
+        appTransmitters = np.flatnonzero(transmitters & usingApp)
+        order = np.argsort(cells[appTransmitters], kind="stable")
+        self.appTransmitters = appTransmitters[order]
+        self.appTransmitterCells = cells[self.appTransmitters]
+        self._index()
+
+    def add(self, cells, tallies):
+        "Add tallies (6 x len(cells), as self.tallies) of infectious humans kept elsewhere, e.g. by another process."
+        self.occupied, self.tallies = sumByCell(np.concatenate([self.occupied, cells]), np.hstack([self.tallies, tallies]))
+        self._index()
+
+    def _index(self):
+        """
+        Find every agent's slot among the occupied cells. Tallies get one more, empty slot at the end, which agents in
+        cells without infectious humans point to, so lookups need no mask.
+        """
+        self.slot = self.slotsOf(self.cells)
+        padded = np.hstack([self.tallies, np.zeros((6, 1))])
+        counts = np.rint(padded[[0, 3]]).astype(np.int64)
+        self.groups = [(inGroup, counts[k], padded[3 * k + 1], padded[3 * k + 2]) for k, inGroup in enumerate(self.inGroups)]
+        self.count = counts.sum(axis=0)
+        self.rateTotal = padded[1] + padded[4]
+        self.rateProbTotal = padded[2] + padded[5]
+
+    def slotsOf(self, cells):
+        "The slot of each of cells in the tallies (count, rateTotal, ...): the empty last slot for unoccupied cells."
+        slot, found = cellIndex(self.occupied, cells)
+        slot[~found] = len(self.occupied)
+        return slot
+
+    def exposed(self, present):
+        "Humans who share a cell with at least one infectious human other than themselves."
+        return np.flatnonzero(present & (self.count[self.slot] > self.transmitters))
+
+    def sample(self, agents, rng):
+        """
+        Draw the contacts each of the given humans had with infectious cellmates this step.
+        Returns (contacts, contactsWithAppUsers, probReceived, appPairs), where probReceived is the summed infection
+        probability of the transmitters met and appPairs is (sources, targets): every contact between two app users.
+        """
+        slots = self.slot[agents]
+        isSelf = self.transmitters[agents]
+        isApp = self.usingApp[agents]
+        contacts = np.zeros(len(agents), dtype=np.int64)
+        probReceived = np.zeros(len(agents))
+        withApp = None
+        for inGroup, count, rate, rateProb in self.groups:
+            own = isSelf & inGroup[agents]  # a transmitter doesn't contact itself
+            n = count[slots] - own
+            if withApp is None:
+                n[isApp] = 0  # drawn pair by pair below
+            rateSum = rate[slots] - own * self.rates[agents]
+            rateProbSum = rateProb[slots] - own * self.rates[agents] * self.prob[agents]
+            met = np.zeros(len(agents), dtype=np.int64)
+            some = np.flatnonzero(n > 0)
+            met[some] = rng.binomial(n[some], np.clip(rateSum[some] / n[some], 0, 1))
+            contacts += met
+            hit = met > 0
+            probReceived[hit] += met[hit] * rateProbSum[hit] / rateSum[hit]
+            if withApp is None:
+                withApp = met
+
+        appAgents = np.flatnonzero(isApp)
+        sources, targets = self.appPairs(agents[appAgents])
+        hit = rng.random(len(sources)) < self.rates[sources]
+        sources, targets = sources[hit], targets[hit]
+        where = np.searchsorted(agents, targets) if len(targets) else targets  # agents is sorted
+        met = np.bincount(where, minlength=len(agents))
+        contacts += met
+        withApp += met
+        probReceived += np.bincount(where, weights=self.prob[sources], minlength=len(agents))
+        return contacts, withApp, probReceived, (sources, targets)
+
+    def appPairs(self, targets):
+        "Every (app transmitter, target) pair in the same cell, other than a transmitter with itself."
+        targetCells = self.cells[targets]
+        start = np.searchsorted(self.appTransmitterCells, targetCells, side="left")
+        lengths = np.searchsorted(self.appTransmitterCells, targetCells, side="right") - start
+        pairTargets = np.repeat(targets, lengths)
+        offsets = np.arange(len(pairTargets)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        pairSources = self.appTransmitters[np.repeat(start, lengths) + offsets]
+        others = pairSources != pairTargets
+        return pairSources[others], pairTargets[others]
+
+    def shareBack(self, poolCells, pool):
+        """
+        Spread a per-cell quantity (pool, at the sorted distinct cells poolCells) over those cells' transmitters in
+        proportion to their contact rates. Used for what infectious contacts pass back to the transmitters who met them.
+        """
+        transmitters = np.flatnonzero(self.transmitters)
+        slots = self.slot[transmitters]
+        share = np.zeros(len(transmitters))
+        has = self.rateTotal[slots] > 0
+        received = cellValues(poolCells, pool, self.cells[transmitters[has]])
+        share[has] = received * self.rates[transmitters[has]] / self.rateTotal[slots[has]]
+        return transmitters, share
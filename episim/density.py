@@ -0,0 +1,150 @@
+"""
+Streaming reader for the NASA GPWv4 population count dataset: 8 ESRI ASCII grids (.asc) of 10800 x 10800 entries,
+split at the equator, the prime meridian and +/-90 degrees longitude.
+
+Nothing is read line by line from the top of a file. The first time a chunk is used, the byte offset of every line is
+indexed (and cached as a .npy file), so a window of rows is a seek per row. Chunks can also be converted once into
+.npy rasters, which are then memory-mapped and windowed directly. Windows that cross chunk borders are stitched.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+BLOCK_SIZE = 1 << 24  # bytes read at a time while indexing lines
+
+
+class AscChunk(object):
+    "One .asc file: its header, where it sits in the world, and windowed reads of its rows."
+
+    def __init__(self, path, cacheDir=None):
+        self.path = path
+        self.cacheDir = cacheDir or os.path.dirname(path)
+        self.header = {}
+        with open(path, "rb") as f:
+            while True:
+                start = f.tell()
+                line = f.readline()
+                key = line.split()[0].decode().lower() if line.strip() else ""
+                if not key or not key[0].isalpha():
+                    break
+                self.header[key] = float(line.split()[1])
+            self.dataStart = start
+        self.ncols = int(self.header["ncols"])
+        self.nrows = int(self.header["nrows"])
+        self.cellsize = self.header["cellsize"]
+        self.nodata = self.header.get("nodata_value", -9999)
+        self.west = self.header.get("xllcorner", self.header.get("xllcenter", 0) - self.cellsize / 2)
+        self.south = self.header.get("yllcorner", self.header.get("yllcenter", 0) - self.cellsize / 2)
+        self.north = self.south + self.nrows * self.cellsize
+        self._lineOffsets = None
+
+    def _cachePath(self, suffix):
+        """
+        Where the chunk's line index or raster is cached. Datasets (GPW years or versions) name their chunks alike, so
+        the name also holds a hash of the chunk's absolute path and size: chunks sharing a cache directory never collide.
+        """
+        source = repr((os.path.abspath(self.path), os.path.getsize(self.path))).encode()
+        name = "%s-%s" % (os.path.splitext(os.path.basename(self.path))[0], hashlib.sha1(source).hexdigest()[:16])
+        return os.path.join(self.cacheDir, name + suffix)
+
+    def _fresh(self, cachePath):
+        return os.path.exists(cachePath) and os.path.getmtime(cachePath) >= os.path.getmtime(self.path)
+
+    @property
+    def lineOffsets(self):
+        "Byte offset of the start of every data row, built by scanning the file for newlines once and cached."
+        if self._lineOffsets is None:
+            indexPath = self._cachePath(".lines.npy")
+            if self._fresh(indexPath):
+                self._lineOffsets = np.load(indexPath)
+            else:
+                newlines = []
+                with open(self.path, "rb") as f:
+                    f.seek(self.dataStart)
+                    position = self.dataStart
+                    while True:
+                        block = f.read(BLOCK_SIZE)
+                        if not block:
+                            break
+                        newlines.append(position + np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord("\n")))
+                        position += len(block)
+                ends = np.concatenate(newlines)
+                self._lineOffsets = np.concatenate(([self.dataStart], ends + 1))[:self.nrows]
+                os.makedirs(self.cacheDir, exist_ok=True)
+                np.save(indexPath, self._lineOffsets)
+        return self._lineOffsets
+
+    def _parseRows(self, rowStart, rowEnd, colStart, colEnd):
+        window = np.empty((rowEnd - rowStart, colEnd - colStart), dtype=np.float32)
+        offsets = self.lineOffsets
+        with open(self.path, "rb") as f:
+            for row in range(rowStart, rowEnd):
+                f.seek(offsets[row])
+                window[row - rowStart] = np.array(f.readline().split()[colStart:colEnd], dtype=np.float32)
+        return window
+
+    def read(self, rowStart, rowEnd, colStart, colEnd):
+        "Rows and columns of the chunk (row 0 is the northernmost), memory-mapped if the chunk has been converted."
+        rasterPath = self._cachePath(".npy")
+        if self._fresh(rasterPath):
+            return np.array(np.load(rasterPath, mmap_mode="r")[rowStart:rowEnd, colStart:colEnd])
+        return self._parseRows(rowStart, rowEnd, colStart, colEnd)
+
+    def convert(self, rowsAtOnce=256):
+        "Write the chunk as a float32 .npy raster in the cache directory, so later reads are memory-mapped windows."
+        os.makedirs(self.cacheDir, exist_ok=True)
+        rasterPath = self._cachePath(".npy")
+        partialPath = rasterPath + ".partial"
+        raster = np.lib.format.open_memmap(partialPath, mode="w+", dtype=np.float32, shape=(self.nrows, self.ncols))
+        for row in range(0, self.nrows, rowsAtOnce):
+            raster[row:row + rowsAtOnce] = self._parseRows(row, min(row + rowsAtOnce, self.nrows), 0, self.ncols)
+        raster.flush()
+        del raster
+        os.replace(partialPath, rasterPath)
+
+
+class DensityRaster(object):
+    "All the .asc chunks in a GPWv4 directory, read as one world-wide raster."
+
+    def __init__(self, popDensityPath, cacheDir=None):
+        self.chunks = [AscChunk(os.path.join(popDensityPath, name), cacheDir)
+                       for name in sorted(os.listdir(popDensityPath)) if name.endswith(".asc")]
+        if not self.chunks:
+            raise ValueError("No .asc files in " + popDensityPath)
+        self.cellsize = self.chunks[0].cellsize
+
+    def convert(self):
+        for chunk in self.chunks:
+            chunk.convert()
+
+    def window(self, min_lat, min_lon, rows, cols):
+        """
+        Population counts for a rows x cols block of cells whose south-west corner is (min_lat, min_lon),
+        stitched from every chunk it overlaps. Row 0 is the southernmost, matching grid indices.
+        Entries with no data, or outside every chunk, are 0.
+        """
+        window = np.zeros((rows, cols), dtype=np.float32)
+        for chunk in self.chunks:
+            # The window's position in this chunk, in chunk rows (counted from the north) and columns.
+            top = int(round((chunk.north - (min_lat + rows * self.cellsize)) / self.cellsize))
+            left = int(round((min_lon - chunk.west) / self.cellsize))
+            rowStart, rowEnd = max(top, 0), min(top + rows, chunk.nrows)
+            colStart, colEnd = max(left, 0), min(left + cols, chunk.ncols)
+            if rowStart >= rowEnd or colStart >= colEnd:
+                continue
+            block = chunk.read(rowStart, rowEnd, colStart, colEnd)
+            block[block == chunk.nodata] = 0
+            window[rows - (rowEnd - top):rows - (rowStart - top), colStart - left:colEnd - left] = block[::-1]
+        return window
+
+    def gridWindow(self, geometry):
+        "window() for the cells of a GridGeometry, which must use the dataset's cell size."
+        if not (np.isclose(geometry.lat_step, self.cellsize) and np.isclose(geometry.lon_step, self.cellsize)):
+            raise ValueError("Grid cells must be the same size as the dataset's (%g degrees)" % self.cellsize)
+        return self.window(geometry.min_lat, geometry.min_lon, geometry.size, geometry.size)
+
+
+def humanCounts(densities, density_to_humans):
+    "Convert population counts to how many stationary humans the model generates. Might want a nonlinear function instead."
+    return np.maximum(0, np.floor_divide(densities, density_to_humans)).astype(np.int64)
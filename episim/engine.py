@@ -0,0 +1,302 @@
+"""
+The array engine: the same model as episimulation() in daniel-blank-virus-sim.py, stepped with batched NumPy operations
+over a Population instead of calling stepTo/interact on every Human.
+"""
+import numpy as np
+
+from episim.cohorts import Cohorts
+from episim.contact import CellKernel, cellIndex, cellValues, contactRates, sumByCell
+from episim.exposure import ExposureDatabase, ExposureLog, newTokens
+from episim.population import Population
+from episim.profile import NULL_PROFILER
+from episim.trajectories import seek
+
+
+class ArrayEngine(object):
+
+    def __init__(self, config, seed=None, profiler=None, geometry=None):
+        self.config = config
+        self.profiler = NULL_PROFILER if profiler is None else profiler  # see episim/profile.py
+        self.cases = 0  # cases as of the last profiled step
+        self.geometry = config.geometry() if geometry is None else geometry  # a band of the grid, in episim.partition
+        self.rng = np.random.default_rng(seed)
+        self.riskGrid = np.zeros((self.geometry.rows, self.geometry.size))
+        self.population = None
+        self.cohorts = None  # background population, when config.background is "cohorts"
+        self.store = None
+        self.time = 0
+        self.steps = 0  # timesteps taken so far
+        self.exposures = ExposureLog()  # app users' Bluetooth interaction IDs
+        self.database = ExposureDatabase()  # IDs published by confirmed app users
+
+    def populate(self, store, stationaryCounts=None, startTime=None):
+        """
+        Build the population: one mobile human per user in the TrajectoryStore, and the stationary humans, either as
+        Cohorts or as agents after the mobile ones (see config.background).
+        stationaryCounts is a grid_size x grid_size array of how many stationary humans stand in each grid A cell.
+        The simulation starts at startTime (a Geolife time), by default the starting time of the first Geolife human.
+        """
+        geometry = self.geometry
+        if stationaryCounts is None:
+            stationaryCounts = np.zeros((geometry.rows, geometry.size), dtype=np.int64)
+        stationaryCounts = np.asarray(stationaryCounts, dtype=np.int64).ravel()
+        if self.config.background == "cohorts":
+            self.cohorts = Cohorts(stationaryCounts, geometry, self.config, self.rng)
+            stationaryCounts = np.zeros_like(stationaryCounts)
+        nMobile = len(store)
+        nStationary = int(stationaryCounts.sum())
+        pop = self.population = Population(nMobile + nStationary, self.config, self.rng)
+
+        cellA = np.repeat(np.arange(geometry.cells), stationaryCounts)
+        firstInCell = np.repeat(np.cumsum(stationaryCounts) - stationaryCounts, stationaryCounts)
+        latIndex, lonIndex = geometry.split(cellA)
+        stationary = slice(nMobile, None)
+        pop.cellA[stationary] = cellA
+        pop.cellB[stationary] = geometry.rotateB(cellA, (np.arange(nStationary) - firstInCell) % 4)
+        pop.lat[stationary] = geometry.min_lat + (latIndex + .5) * geometry.lat_step
+        pop.lon[stationary] = geometry.min_lon + (lonIndex + .5) * geometry.lon_step
+
+        pop.mobile[:nMobile] = True
+        self.store = store
+        self.fix = np.array(store.offsets[:-1], dtype=np.int64)  # each mobile human's current fix in the store
+        self.lastFix = np.array(store.offsets[1:], dtype=np.int64)
+        pop.alive[:nMobile] = self.fix < self.lastFix
+        if startTime is not None:
+            self.time = startTime
+        elif nMobile and pop.alive[0]:
+            self.time = float(store.time[self.fix[0]])
+        pop.time = self.time
+        self._move(self.time)
+
+    def seedInfection(self):
+        "Infect a Geolife human at random, and confirm with a CDC code."
+        index = self.rng.integers(len(self.fix))
+        self.confirm([index])
+        return index
+
+    def confirm(self, index):
+        "Confirm the humans at index as cases with CDC codes. App users among them publish their interaction IDs."
+        pop = self.population
+        index = np.asarray(index)
+        pop.infect(index, confirmed=True)
+        self.database.publish(self.exposures.tokensOf(index[pop.usingApp[index]]))
+
+    def _move(self, time):
+        """
+        Jump every mobile human to its first fix at or after time, with one batched binary search over the store.
+        Humans who run out of fixes leave the simulation.
+        """
+        pop = self.population
+        moving = np.flatnonzero(pop.alive[:len(self.fix)] & pop.mobile[:len(self.fix)])
+        before = self.fix[moving]
+        self.fix[moving] = seek(self.store.time, before, self.lastFix[moving], time)
+        if self.profiler.enabled:
+            self.profiler.count("humans moved", len(moving))
+            self.profiler.count("fixes consumed", int((self.fix[moving] - before).sum()))
+        ended = self.fix[moving] >= self.lastFix[moving]
+        pop.alive[moving[ended]] = False  # end of all trajectories; this human leaves the simulation.
+        moving = moving[~ended]
+        pop.place(moving, self.store.lat[self.fix[moving]], self.store.lon[self.fix[moving]], self.geometry)
+
+    def step(self, time, snapshots=None):
+        """
+        Advance everyone to the given time: move, progress the disease, then let infectious humans spread it.
+        snapshots is an optional SnapshotWriter, given the snapshotLayers() after the step.
+        """
+        profiler = self.profiler
+        dt = time - self.time
+        self.time = time
+        self.steps += 1
+        with profiler.phase("move"):
+            self._move(time)
+        with profiler.phase("progress"):
+            self.population.progress(time, self.riskGrid)
+            if self._background() is not None:
+                self.cohorts.progress(dt, self.riskGrid)
+        with profiler.phase("contact"):
+            self._contact()
+        with profiler.phase("test"):
+            self._test(dt)
+        with profiler.phase("exposures"):
+            self._checkExposures()
+        if snapshots is not None:
+            with profiler.phase("snapshot"):
+                snapshots.record(time, self.snapshotLayers())
+        if profiler.enabled:
+            self._countStep()
+        profiler.endStep(time)
+
+    def _countStep(self):
+        profiler = self.profiler
+        cases = self.counts()["cases"]
+        profiler.count("infections", cases - self.cases)
+        self.cases = cases
+        profiler.set("exposure log", len(self.exposures))
+        profiler.set("published IDs", len(self.database))
+
+    def _contact(self):
+        pop = self.population
+        cohorts = self._background()
+        present = pop.alive & ~pop.quarantined  # quarantined humans are isolated.
+        transmitters = pop.infectious() & present
+        if not self._anywhere(transmitters.any() or (cohorts is not None and cohorts.I.any())):
+            return
+        rates = contactRates(pop.age, self.config.contact_rate)
+        contacts = np.zeros(pop.size, dtype=np.int64)
+        withApp = np.zeros(pop.size, dtype=np.int64)
+        probReceived = np.zeros(pop.size)
+        grids = []
+        appPairs = []
+        for cells, grid in ((pop.cellA, "A"), (pop.cellB, "B")):
+            background = None if cohorts is None else cohorts.transmitterTotals(getattr(cohorts, "cell" + grid))
+            kernel = CellKernel(cells, transmitters, rates, pop.prob, pop.usingApp, background)
+            self._shareKernel(kernel, grid)
+            agents = kernel.exposed(present)
+            met, metApp, prob, pairs = kernel.sample(agents, self.rng)
+            appPairs.append(pairs)
+            contacts[agents] += met
+            withApp[agents] += metApp
+            probReceived[agents] += prob
+            grids.append((grid, kernel, agents, met))
+        if cohorts is None:
+            fanA = fanB = np.zeros(0, dtype=np.int64)
+        else:
+            fanA, fanB = cohorts.expose([kernel for grid, kernel, agents, met in grids])
+        if self.profiler.enabled:
+            self.profiler.count("contacts", int(contacts.sum()))
+        self._interact(contacts, withApp, probReceived, grids, fanA, fanB)
+        sources = np.concatenate([pair[0] for pair in appPairs])
+        targets = np.concatenate([pair[1] for pair in appPairs])
+        self.exposures.record(sources, targets, newTokens(self.rng, len(sources)))
+
+    def _interact(self, contacts, withApp, probReceived, grids, fanA, fanB):
+        """
+        Apply this step's contacts with the rules of Human.interact: everyone met by an infectious human is infected
+        and picks up some of their probability; an infectious human who is met passes probability back to the
+        transmitters in its cell and infects everyone in its A and B cells. fanA and fanB are further cells where that
+        happened to a background human.
+        """
+        pop = self.population
+        config = self.config
+        targets = np.flatnonzero(contacts)
+        spreadsBack = pop.infectious()[targets]
+        fanners = targets[spreadsBack]
+        fannerProb = pop.prob[fanners]
+        pop.infect(targets)
+        pop.prob[targets] += config.transmission_prob_close * probReceived[targets]
+
+        backToApp = np.zeros(pop.size, dtype=bool)
+        for grid, kernel, agents, met in grids:
+            spread = (met > 0) & pop.infectious()[agents]
+            back = agents[spread]
+            cells = kernel.cells[back]
+            poolCells, pool = sumByCell(cells, met[spread] * pop.prob[back])
+            poolCells, pool = self._shareCells(poolCells, pool, grid)
+            transmitters, share = kernel.shareBack(poolCells, pool[0])
+            pop.prob[transmitters] += config.transmission_prob_close * share
+            appCells = np.unique(cells[pop.usingApp[back]])
+            backToApp[transmitters] |= cellIndex(appCells, kernel.cells[transmitters])[1]
+
+        if self._anywhere(len(fanners) > 0 or len(fanA) > 0 or len(fanB) > 0):
+            weights = np.concatenate([fannerProb, np.zeros(len(fanA))])
+            cellsA, riskA = sumByCell(np.concatenate([pop.cellA[fanners], fanA]), weights)
+            cellsB, riskB = sumByCell(np.concatenate([pop.cellB[fanners], fanB]), weights)
+            cellsB, riskB = self._shareCells(cellsB, riskB, "B")
+            inA = cellIndex(cellsA, pop.cellA)[1]
+            inB = cellIndex(cellsB, pop.cellB)[1]
+            everyone = np.flatnonzero(pop.alive & (inA | inB))
+            pop.infect(everyone)
+            pop.prob[everyone] += config.transmission_prob_far * (cellValues(cellsA, riskA[0], pop.cellA[everyone]) +
+                                                                  cellValues(cellsB, riskB[0], pop.cellB[everyone]))
+            if self._background() is not None:
+                self.cohorts.infectCells(cellsA, cellsB)
+
+        # App users quarantine when their probability is too high after meeting another app user.
+        quarantine = pop.usingApp & (pop.prob > config.quarantine_threshold) & ((withApp > 0) | backToApp)
+        pop.quarantined |= quarantine
+
+    # Hooks for episim.partition, where each process steps the humans of one band of rows of the grid: cells on the
+    # border of two bands (rows of grid B, which is offset by half a cell) hold humans of both. Here the engine holds
+    # everyone, so they return what they are given.
+
+    def _anywhere(self, flag):
+        "Whether flag, computed from the humans held here, is true for any humans of the run."
+        return bool(flag)
+
+    def _shareKernel(self, kernel, grid):
+        "Add the infectious humans held elsewhere to the tallies of a CellKernel of grid \"A\" or \"B\"."
+
+    def _shareCells(self, cells, values, grid):
+        """
+        Per-cell values of one grid, given as sorted distinct cells and a stack of values (k x len(cells)), summed over
+        every holder of each cell. Returns (cells, values) likewise.
+        """
+        return cells, values
+
+    def _test(self, dt):
+        "Infectious humans are tested and confirmed at config.confirmation_rate per day."
+        if self.config.confirmation_rate <= 0:
+            return
+        pop = self.population
+        candidates = np.flatnonzero(pop.infectious() & ~pop.confirmed)
+        tested = candidates[self.rng.random(len(candidates)) < self.config.confirmation_rate * dt]
+        if len(tested):
+            self.confirm(tested)
+
+    def _checkExposures(self):
+        """
+        App users check their interaction IDs against those published since the last check, all in one batch, as
+        Human.checkForSickness does one human at a time. A match makes them likely infected, and may quarantine them.
+        Confirmed humans, whose own published IDs match their histories, already know they are infected.
+        """
+        pop = self.population
+        exposed = self.database.match(self.exposures)
+        exposed = exposed[pop.alive[exposed] & ~pop.confirmed[exposed]]
+        if len(exposed) == 0:
+            return
+        pop.infect(exposed)
+        pop.prob[exposed] = np.minimum(pop.prob[exposed] + self.config.transmission_prob_close, 1)
+        pop.quarantined[exposed] |= pop.prob[exposed] > self.config.quarantine_threshold
+
+    def _background(self):
+        "The Cohorts, unless there are no background humans to step."
+        return self.cohorts if self.cohorts is not None and len(self.cohorts) else None
+
+    def counts(self):
+        "Epidemic statistics for the whole population, agents and cohorts together."
+        counts = self.population.counts()
+        if self.cohorts is not None:
+            for key, value in self.cohorts.counts().items():
+                counts[key] += value
+        return counts
+
+    def extinct(self):
+        "Whether nobody, agent or cohort, is infected any more, so the epidemic can't change again."
+        pop = self.population
+        if (pop.alive & pop.infected).any():
+            return False
+        return self.cohorts is None or not (self.cohorts.E.any() or self.cohorts.I.any())
+
+    def snapshotLayers(self):
+        "The grids a SnapshotWriter records: cumulative risk, and how many humans are infected, per grid A cell."
+        pop = self.population
+        cells = self.geometry.cells
+        infected = np.bincount(pop.cellA[pop.alive & pop.infected], minlength=cells).astype(np.float64)
+        if self.cohorts is not None:
+            cohorts = self.cohorts
+            infected += np.bincount(cohorts.cellA, weights=(cohorts.E + cohorts.I).sum(axis=1), minlength=cells)
+        return {"risk": self.riskGrid, "infected": infected.reshape(self.riskGrid.shape)}
+
+    def run(self, length=None, snapshots=None, checkpoints=None):
+        """
+        Step through length timesteps from the current time; by default, whatever is left of config.length_of_sim.
+        snapshots is an optional SnapshotWriter, given the snapshotLayers() after every step, and checkpoints an
+        optional Checkpointer, which saves the engine's state every so many steps.
+        """
+        if length is None:
+            length = self.config.length_of_sim - self.steps
+        for k in range(length):
+            self.step(self.time + self.config.timestep_size, snapshots)
+            if checkpoints is not None:
+                checkpoints.stepped(self)
+        return self.counts()
@@ -0,0 +1,104 @@
+"""
+Monte Carlo ensembles: many independent replicates of the array engine, spread over a process pool.
+
+Each worker loads the shared, read-only inputs once (the memory-mapped TrajectoryStore and the stationary counts), then
+runs replicates with seeds spawned from one SeedSequence, so an ensemble is reproducible from its entropy alone
+whatever the number of processes. Risk grids and outcome counts are merged into means and quantiles.
+"""
+import multiprocessing
+import os
+
+import numpy as np
+
+from episim.engine import ArrayEngine
+from episim.snapshots import SnapshotWriter
+from episim.trajectories import TrajectoryStore
+
+_inputs = {}  # per-worker: the inputs every replicate shares, set up once by _initWorker
+
+
+def _initWorker(config, storePath, stationaryCounts, startTime, snapshotPath=None, snapshotInterval=1.):
+    _inputs["config"] = config
+    _inputs["store"] = TrajectoryStore(storePath)
+    _inputs["stationaryCounts"] = stationaryCounts
+    _inputs["startTime"] = startTime
+    _inputs["snapshotPath"] = snapshotPath
+    _inputs["snapshotInterval"] = snapshotInterval
+
+
+def runReplicate(config, store, stationaryCounts, startTime, seed, snapshots=None, profiler=None):
+    """
+    One run of the array engine: returns its outcome counts and its risk grid.
+    snapshots is an optional SnapshotWriter for the run's time series, and profiler an optional Profiler for its steps.
+    """
+    engine = ArrayEngine(config, seed, profiler)
+    engine.populate(store, stationaryCounts, startTime)
+    engine.seedInfection()
+    counts = engine.run(snapshots=snapshots)
+    return counts, engine.riskGrid.astype(np.float32)
+
+
+def _runIndexed(job):
+    index, seed = job
+    snapshots = None
+    if _inputs["snapshotPath"] is not None:  # one directory of snapshots per replicate
+        snapshots = SnapshotWriter(os.path.join(_inputs["snapshotPath"], "replicate-%04d" % index),
+                                   _inputs["config"].geometry(), _inputs["snapshotInterval"])
+    counts, riskGrid = runReplicate(_inputs["config"], _inputs["store"], _inputs["stationaryCounts"], _inputs["startTime"],
+                                    seed, snapshots)
+    if snapshots is not None:
+        snapshots.close()
+    return index, counts, riskGrid
+
+
+class EnsembleResult(object):
+
+    def __init__(self, entropy, counts, riskGrids):
+        self.entropy = entropy  # SeedSequence entropy the replicate seeds were spawned from
+        self.counts = counts  # outcome name -> array with one entry per replicate
+        self.riskGrids = riskGrids  # replicates x grid_size x grid_size
+
+    def __len__(self):
+        return len(self.riskGrids)
+
+    def riskMean(self):
+        return self.riskGrids.mean(axis=0)
+
+    def riskQuantiles(self, quantiles=(.05, .5, .95)):
+        "Per-cell quantiles of risk across replicates: len(quantiles) x grid_size x grid_size."
+        return np.quantile(self.riskGrids, quantiles, axis=0)
+
+    def summary(self, quantiles=(.05, .5, .95)):
+        "Outcome name -> (mean, [quantiles]) across replicates."
+        return dict((name, (float(values.mean()), [float(q) for q in np.quantile(values, quantiles)]))
+                    for name, values in self.counts.items())
+
+
+def runEnsemble(config, storePath, stationaryCounts, replicates, seed=None, processes=None, startTime=None,
+                snapshotPath=None, snapshotInterval=1.):
+    """
+    Run replicates independent simulations across a pool of processes (all cores by default; 1 runs in this process).
+    seed is the entropy of the SeedSequence that per-replicate seeds are spawned from; None picks fresh entropy.
+    With a snapshotPath, each replicate writes snapshots every snapshotInterval days to snapshotPath/replicate-NNNN.
+    """
+    sequence = np.random.SeedSequence(seed)
+    jobs = list(enumerate(sequence.spawn(replicates)))
+    results = [None] * replicates
+    if processes == 1:
+        _initWorker(config, storePath, stationaryCounts, startTime, snapshotPath, snapshotInterval)
+        finished = map(_runIndexed, jobs)
+    else:
+        pool = multiprocessing.Pool(processes, _initWorker,
+                                    (config, storePath, stationaryCounts, startTime, snapshotPath, snapshotInterval))
+        finished = pool.imap_unordered(_runIndexed, jobs)
+    try:
+        for index, counts, riskGrid in finished:
+            results[index] = (counts, riskGrid)
+    finally:
+        if processes != 1:
+            pool.close()
+            pool.join()
+    names = results[0][0].keys() if results else ()
+    counts = dict((name, np.array([result[0][name] for result in results])) for name in names)
+    riskGrids = np.array([result[1] for result in results]) if results else np.zeros((0, config.grid_size, config.grid_size))
+    return EnsembleResult(sequence.entropy, counts, riskGrids)
@@ -0,0 +1,113 @@
+"""
+Exposure matching for the app. Every Bluetooth interaction between two app users creates a random 64-bit ID that both
+keep in their history; confirmed cases publish their history, and app users check their own history against what has
+been published.
+
+Histories are kept as two flat arrays (owner, token) instead of a list per human, the published tokens as one sorted
+array, and matching is a batched intersection. Each batch of newly published tokens is also put in a Bloom filter,
+the check an app would run on the phone, so that only the few histories that might match are checked exactly.
+"""
+import math
+
+import numpy as np
+
+TOKEN_DTYPE = np.uint64
+
+
+def newTokens(rng, n):
+    "n random, nonzero 64-bit interaction IDs."
+    return rng.integers(1, np.iinfo(TOKEN_DTYPE).max, n, dtype=TOKEN_DTYPE, endpoint=True)
+
+
+class BloomFilter(object):
+    "A Bloom filter of 64-bit tokens: no false negatives, and about errorRate false positives."
+
+    def __init__(self, capacity, errorRate=.001):
+        capacity = max(int(capacity), 1)
+        self.bits = max(64, int(-capacity * math.log(errorRate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+        self.table = np.zeros((self.bits + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, tokens):
+        # Tokens are already uniformly random, so two cheap mixes of them give the double-hashing sequence h1 + i * h2.
+        tokens = np.asarray(tokens, dtype=TOKEN_DTYPE)
+        h1 = tokens * np.uint64(0x9E3779B97F4A7C15)
+        h2 = (tokens ^ (tokens >> np.uint64(29))) * np.uint64(0xBF58476D1CE4E5B9) | np.uint64(1)
+        steps = np.arange(self.hashes, dtype=TOKEN_DTYPE)
+        return ((h1[:, None] + steps * h2[:, None]) % np.uint64(self.bits)).astype(np.int64)
+
+    def add(self, tokens):
+        positions = self._positions(tokens).ravel()
+        np.bitwise_or.at(self.table, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+
+    def mightContain(self, tokens):
+        if len(tokens) == 0:
+            return np.zeros(0, dtype=bool)
+        positions = self._positions(tokens)
+        return ((self.table[positions >> 3] >> (positions & 7).astype(np.uint8)) & 1).all(axis=1).astype(bool)
+
+
+class ExposureLog(object):
+    "Every app user's history of interaction IDs, as flat (owner, token) arrays that grow in place."
+
+    def __init__(self, capacity=1024):
+        self.owner = np.zeros(capacity, dtype=np.int64)
+        self.token = np.zeros(capacity, dtype=TOKEN_DTYPE)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def record(self, sources, targets, tokens):
+        "Both humans of each interaction keep its token."
+        owners = np.concatenate((sources, targets))
+        tokens = np.concatenate((tokens, tokens))
+        end = self.size + len(owners)
+        if end > len(self.owner):
+            capacity = max(end, 2 * len(self.owner))
+            self.owner = np.resize(self.owner, capacity)
+            self.token = np.resize(self.token, capacity)
+        self.owner[self.size:end] = owners
+        self.token[self.size:end] = tokens
+        self.size = end
+
+    def tokensOf(self, owners):
+        "Every token in the histories of the given humans."
+        return self.token[:self.size][np.isin(self.owner[:self.size], owners)]
+
+
+class ExposureDatabase(object):
+    "Tokens published by confirmed cases, kept sorted and unique."
+
+    def __init__(self):
+        self.tokens = np.zeros(0, dtype=TOKEN_DTYPE)
+        self.pending = []  # batches published since the last match
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __contains__(self, token):
+        i = np.searchsorted(self.tokens, token)
+        return bool(i < len(self.tokens) and self.tokens[i] == token)
+
+    def publish(self, tokens):
+        tokens = np.setdiff1d(np.asarray(tokens, dtype=TOKEN_DTYPE), self.tokens)
+        if len(tokens):
+            self.tokens = np.union1d(self.tokens, tokens)
+            self.pending.append(tokens)
+
+    def match(self, log):
+        """
+        Match every history in the log against the tokens published since the last match, in one pass.
+        Returns the humans (sorted, unique) with at least one published token in their history.
+        """
+        if not self.pending:
+            return np.zeros(0, dtype=np.int64)
+        fresh = np.concatenate(self.pending)
+        self.pending = []
+        bloom = BloomFilter(len(fresh))
+        bloom.add(fresh)
+        tokens = log.token[:log.size]
+        candidates = np.flatnonzero(bloom.mightContain(tokens))
+        exposed = candidates[np.isin(tokens[candidates], fresh)]
+        return np.unique(log.owner[exposed])
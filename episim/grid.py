@@ -0,0 +1,110 @@
+"""
+Grid geometry shared by the array engine: converting latitude/longitude to A and B grid cells.
+
+Cells are stored as flat indices (latIndex * size + lonIndex) so that per-cell tallies are a single np.bincount.
+"""
+import numpy as np
+
+# Stationary humans in a grid A cell are split evenly among the 4 grid B cells it overlaps: the k-th human in a cell
+# goes to the B cell offset by B_ROTATION[k % 4] (in lat, lon indices) from the cell's own index.
+B_ROTATION = np.array([[0, 0], [0, 1], [1, 1], [1, 0]])
+
+
+class GridGeometry(object):
+    "size cells on a side, or size cells of longitude by rows of latitude for a band of a grid (see band())."
+
+    def __init__(self, min_lat, min_lon, lat_step, lon_step, size, rows=None):
+        self.min_lat = min_lat
+        self.min_lon = min_lon
+        self.lat_step = lat_step
+        self.lon_step = lon_step
+        self.size = size
+        self.rows = size if rows is None else rows
+        self.max_lat = min_lat + self.rows * lat_step
+        self.max_lon = min_lon + size * lon_step
+
+    @property
+    def cells(self):
+        return self.rows * self.size
+
+    def band(self, start, rows):
+        "The geometry of rows rows of this grid from row start, whose flat indices start at 0 in that row."
+        return GridGeometry(self.min_lat + start * self.lat_step, self.min_lon, self.lat_step, self.lon_step, self.size, rows)
+
+    def gridify(self, lat, lon):
+        """
+        Vectorized version of the script's gridify(): takes arrays of latitudes and longitudes and returns
+        (cellA, cellB) flat cell indices. Grid B is offset by half a cell; positions off the grid are clamped to the edge.
+        """
+        lat = (np.asarray(lat, dtype=np.float64) - self.min_lat) / self.lat_step
+        lon = (np.asarray(lon, dtype=np.float64) - self.min_lon) / self.lon_step
+        top = self.rows - 1
+        right = self.size - 1
+        latA = np.clip(np.floor(lat), 0, top).astype(np.int64)
+        lonA = np.clip(np.floor(lon), 0, right).astype(np.int64)
+        latB = np.clip(np.floor(lat + .5), 0, top).astype(np.int64)
+        lonB = np.clip(np.floor(lon + .5), 0, right).astype(np.int64)
+        return latA * self.size + lonA, latB * self.size + lonB
+
+    def split(self, cell):
+        "Flat cell index (or array of them) to (latIndex, lonIndex)."
+        return np.divmod(cell, self.size)
+
+    def flat(self, latIndex, lonIndex):
+        return np.asarray(latIndex) * self.size + np.asarray(lonIndex)
+
+    def rotateB(self, cellA, quadrant):
+        "The grid B cell that the stationary humans with B_ROTATION quadrant in grid A cell cellA stand in."
+        latIndex, lonIndex = self.split(cellA)
+        offsets = B_ROTATION[quadrant]
+        return self.flat(np.minimum(latIndex + offsets[..., 0], self.rows - 1), np.minimum(lonIndex + offsets[..., 1], self.size - 1))
+
+
+class CellGrid(object):
+    """
+    A size x size grid of cells holding humans, with O(1) add, remove and move. Every member's cell and its slot in
+    that cell's list are remembered, so removing it swaps the cell's last member into its slot instead of scanning the list.
+    grid[i, j] is the list of members of cell (i, j); treat it as read-only.
+    """
+
+    def __init__(self, size):
+        self.resize(size)
+
+    def resize(self, size):
+        "Change the number of cells on a side. Empties the grid."
+        self.size = size
+        self.members = [[] for _ in range(size * size)]
+        self.slots = {}  # member -> (flat cell, index in that cell's list)
+
+    def __getitem__(self, index):
+        i, j = index
+        return self.members[i * self.size + j]
+
+    def __contains__(self, member):
+        return member in self.slots
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, member, index):
+        cell = index[0] * self.size + index[1]
+        members = self.members[cell]
+        self.slots[member] = (cell, len(members))
+        members.append(member)
+
+    def remove(self, member):
+        cell, slot = self.slots.pop(member)
+        members = self.members[cell]
+        last = members.pop()
+        if last is not member:
+            members[slot] = last
+            self.slots[last] = (cell, slot)
+
+    def move(self, member, index):
+        if member in self.slots:
+            self.remove(member)
+        self.add(member, index)
+
+    def counts(self):
+        "How many members each cell has, as a size x size array."
+        return np.array([len(members) for members in self.members]).reshape(self.size, self.size)
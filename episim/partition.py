@@ -0,0 +1,328 @@
+"""
+Spatially partitioned runs: one run of the array engine over a large grid, split into bands of rows (tiles) that worker
+processes step in lockstep, so a single run uses every core.
+
+Each worker holds the humans whose grid A cell lies in its band: its stationary humans (agents or cohorts) for the whole
+run, and the Geolife humans currently there. Contacts never cross grid A cells, but grid B is offset by half a cell, so
+the grid B row on the border of two bands holds humans of both. Everything drawn per cell there (the tallies of
+infectious humans, what is passed back to them, the cells everyone is infected in) is summed across the two workers
+through a halo buffer in shared memory before it is used. Geolife humans who move into another band migrate to its
+worker, carrying all their attributes and their place in their trajectories, through per-worker mailboxes in shared
+memory. Workers draw from independent streams spawned from one SeedSequence, so a partitioned run is reproducible for a
+given number of tiles, and statistically equivalent to (not the same as) a single-process run with the same seed.
+
+App users' Bluetooth IDs are exchanged pair by pair with the transmitters in their cell, which would need those
+transmitters' identities across the border too, so partitioned runs require app_adoption = 0.
+
+    python -m episim --geolife "Geolife Trajectories 1.3/Data" --popdensity gpwv4 --tiles 8
+"""
+import multiprocessing
+import os
+import queue
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from episim.contact import sumByCell
+from episim.engine import ArrayEngine
+from episim.population import Population
+from episim.trajectories import TrajectoryStore
+
+HALO_DEPTH = 7  # the most per-cell arrays shared at once: a CellKernel's tallies, and which cells there are
+TRAVEL_FIELDS = ("fix", "lastFix", "user")  # what a Geolife human carries besides its Population attributes
+
+
+def tileBounds(rowWeights, tiles):
+    """
+    Split rows (of weights rowWeights, e.g. how many humans stand in each) into tiles bands of about equal weight.
+    Returns tiles + 1 bounds: band k is rows bounds[k] to bounds[k + 1]. Every band has at least one row.
+    """
+    weights = np.asarray(rowWeights, dtype=np.float64)
+    rows = len(weights)
+    if not 1 <= tiles <= rows:
+        raise ValueError("Can't split %d rows into %d tiles" % (rows, tiles))
+    cumulative = np.cumsum(weights + max(weights.sum(), 1.) / rows)  # every row weighs something, so empty rows split too
+    bounds = [0]
+    for k in range(1, tiles):
+        cut = int(np.searchsorted(cumulative, cumulative[-1] * k / tiles)) + 1
+        bounds.append(min(max(cut, bounds[-1] + 1), rows - (tiles - k)))
+    bounds.append(rows)
+    return np.array(bounds)
+
+
+class SharedArray(object):
+    "A NumPy array in shared memory: created by the parent process, attached to by name in the workers."
+
+    def __init__(self, shape, dtype, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        nbytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=nbytes)
+        self.array = np.ndarray(self.shape, self.dtype, buffer=self.memory.buf)
+        if name is None:
+            self.array[...] = 0
+
+    def spec(self):
+        "What a worker needs to attach to the array: SharedArray(*spec)."
+        return self.shape, self.dtype.str, self.memory.name
+
+    def close(self, unlink=False):
+        self.array = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+class Exchange(object):
+    """
+    The shared memory and barrier the workers of a partitioned run communicate through:
+    halo: tiles x 2 x HALO_DEPTH x size, each worker's contributions to the grid B rows at the top and bottom of its band;
+    flags: one per worker, for _anywhere();
+    mailbox: tiles x capacity x fields, the Geolife humans leaving each worker, with their destination in the last field;
+    sent: how many humans each worker's mailbox holds;
+    risk: the size x size risk grid, each worker writing its own rows at the end.
+    """
+    NAMES = ("halo", "flags", "mailbox", "sent", "risk")
+
+    def __init__(self, barrier, arrays):
+        self.barrier = barrier
+        self.arrays = arrays
+        for name in self.NAMES:
+            setattr(self, name, arrays[name].array)
+
+    @classmethod
+    def create(cls, tiles, size, capacity, fields):
+        shapes = {
+            "halo": ((tiles, 2, HALO_DEPTH, size), np.float64),
+            "flags": ((tiles,), np.bool_),
+            "mailbox": ((tiles, max(capacity, 1), fields + 1), np.float64),
+            "sent": ((tiles,), np.int64),
+            "risk": ((size, size), np.float64),
+        }
+        return cls(multiprocessing.Barrier(tiles), dict((name, SharedArray(*shapes[name])) for name in cls.NAMES))
+
+    def specs(self):
+        return dict((name, shared.spec()) for name, shared in self.arrays.items())
+
+    @classmethod
+    def attach(cls, barrier, specs):
+        return cls(barrier, dict((name, SharedArray(*spec)) for name, spec in specs.items()))
+
+    def wait(self):
+        self.barrier.wait()
+
+    def close(self, unlink=False):
+        for name in self.NAMES:
+            setattr(self, name, None)
+        for shared in self.arrays.values():
+            shared.close(unlink)
+
+
+class TileEngine(ArrayEngine):
+    """
+    The part of a partitioned run one worker steps: the humans whose grid A cell is in rows bounds[tile] to
+    bounds[tile + 1]. Every TileEngine of a run must take the same steps, since they wait for each other at every exchange.
+
+    Its geometry is the band alone, plus the grid B row below it that it shares with the next band (the last band has
+    none), so its cells are numbered from the band's first row and its risk grid and tallies only cover the band.
+    world is the geometry of the whole grid.
+    """
+
+    def __init__(self, config, tile, bounds, exchange, seed=None):
+        if config.app_adoption > 0:
+            raise ValueError("Partitioned runs don't model the app: set app_adoption to 0")
+        self.tile = tile
+        self.bounds = bounds
+        self.start = bounds[tile]
+        self.stop = bounds[tile + 1]
+        self.last = tile == len(bounds) - 2
+        self.world = config.geometry()
+        band = self.world.band(self.start, self.stop - self.start + (0 if self.last else 1))
+        ArrayEngine.__init__(self, config, seed, geometry=band)
+        self.exchange = exchange
+        self.user = None  # each held Geolife human's index in the TrajectoryStore (-1 for stationary humans)
+
+    def populate(self, store, stationaryCounts=None, startTime=None):
+        "As ArrayEngine.populate(), keeping the stationary humans of this band and the Geolife humans in it."
+        geometry = self.geometry
+        counts = np.zeros((geometry.rows, geometry.size), dtype=np.int64)
+        if stationaryCounts is not None:  # the shared row below the band holds the next band's stationary humans
+            counts[:self.stop - self.start] = np.asarray(stationaryCounts)[self.start:self.stop]
+        ArrayEngine.populate(self, store, counts, startTime)
+        pop = self.population
+        nMobile = len(self.fix)
+        self.fix = np.concatenate([self.fix, np.zeros(pop.size - nMobile, dtype=np.int64)])
+        self.lastFix = np.concatenate([self.lastFix, np.zeros(pop.size - nMobile, dtype=np.int64)])
+        user = np.full(pop.size, -1, dtype=np.int64)
+        user[:nMobile] = np.arange(nMobile)
+        # Geolife humans without any fixes never enter; the first worker counts them as departed.
+        owner = self._owner(pop.lat, pop.lon)
+        held = np.flatnonzero(~pop.mobile | np.where(pop.alive, owner == self.tile, self.tile == 0))
+        pop.select(held)
+        self.fix, self.lastFix, self.user = self.fix[held], self.lastFix[held], user[held]
+
+    def infectUser(self, user):
+        "Infect and confirm the Geolife human with index user in the store, if this worker holds it."
+        self.confirm(np.flatnonzero(self.user == user))
+
+    def _owner(self, lat, lon):
+        "The tile whose band holds each position's grid A cell."
+        cellA = self.world.gridify(lat, lon)[0]
+        return np.searchsorted(self.bounds[1:], cellA // self.world.size, side="right")
+
+    def _move(self, time):
+        ArrayEngine._move(self, time)
+        if self.user is not None:  # populate() moves everyone once before choosing who this worker holds
+            self._migrate()
+
+    def _migrate(self):
+        "Send the Geolife humans who have moved out of this band to their new workers, and take in those arriving."
+        pop = self.population
+        exchange = self.exchange
+        moving = np.flatnonzero(pop.mobile & pop.alive)
+        owner = self._owner(pop.lat[moving], pop.lon[moving])
+        leaving = moving[owner != self.tile]
+        owner = owner[owner != self.tile]
+        arrays = pop.arrays()
+        names = sorted(arrays)
+        extra = dict(zip(TRAVEL_FIELDS, (self.fix, self.lastFix, self.user)))
+        columns = [arrays[name][leaving] for name in names] + [extra[name][leaving] for name in TRAVEL_FIELDS]
+        exchange.mailbox[self.tile, :len(leaving)] = np.column_stack(columns + [owner])
+        exchange.sent[self.tile] = len(leaving)
+        exchange.wait()
+        arriving = np.concatenate([exchange.mailbox[tile, :exchange.sent[tile]] for tile in range(len(exchange.sent))])
+        arriving = arriving[arriving[:, -1] == self.tile]
+        exchange.wait()  # everyone has read the mailboxes, which may be written again
+        if len(leaving):
+            keep = np.ones(pop.size, dtype=bool)
+            keep[leaving] = False
+            staying = np.flatnonzero(keep)
+            pop.select(staying)
+            self.fix, self.lastFix, self.user = self.fix[staying], self.lastFix[staying], self.user[staying]
+        if len(arriving):
+            first = pop.size
+            pop.extend(dict((name, arriving[:, k]) for k, name in enumerate(names)))
+            pop.place(np.arange(first, pop.size), pop.lat[first:], pop.lon[first:], self.geometry)  # in this band's cells
+            travel = arriving[:, len(names):len(names) + len(TRAVEL_FIELDS)].astype(np.int64)
+            self.fix, self.lastFix, self.user = [np.concatenate([mine, theirs]) for mine, theirs in
+                                                 zip((self.fix, self.lastFix, self.user), travel.T)]
+
+    def _anywhere(self, flag):
+        exchange = self.exchange
+        exchange.flags[self.tile] = flag
+        exchange.wait()
+        anywhere = bool(exchange.flags.any())
+        exchange.wait()
+        return anywhere
+
+    def _shareKernel(self, kernel, grid):
+        if grid == "B":
+            cells, tallies = self._shareCells(kernel.occupied, kernel.tallies, grid, added=True)
+            kernel.add(cells, tallies)
+
+    def _shareCells(self, cells, values, grid, added=False):
+        """
+        Grid A cells are only ever held by one worker. The grid B row at the top of this band (its first row) is
+        shared with the band before it, and the row below the band's last grid A row (its last row) with the band after
+        it: each worker writes its values in those rows to the halo buffer, with a last row marking which cells it has,
+        and reads its neighbours'. Only those two rows are copied.
+        With added, only the neighbours' values are returned, to be added to the given ones by the caller.
+        """
+        if grid == "A":
+            return cells, values
+        exchange = self.exchange
+        size = self.geometry.size
+        depth = len(values)
+        row, column = np.divmod(cells, size)
+        borders = [(0, 0, self.tile - 1, 1)]  # (side of this band, its row, neighbour, side of the neighbour)
+        if not self.last:
+            borders.append((1, self.geometry.rows - 1, self.tile + 1, 0))
+        for side, border, neighbour, theirSide in borders:
+            halo = exchange.halo[self.tile, side]
+            halo[:depth + 1] = 0
+            here = row == border
+            halo[:depth, column[here]] = values[:, here]
+            halo[depth, column[here]] = 1
+        exchange.wait()
+        sharedCells = [np.zeros(0, dtype=np.int64) if added else cells]
+        sharedValues = [np.zeros((depth, 0)) if added else values]
+        for side, border, neighbour, theirSide in borders:
+            if neighbour < 0:
+                continue
+            halo = exchange.halo[neighbour, theirSide]
+            theirs = np.flatnonzero(halo[depth])
+            sharedCells.append(border * size + theirs)
+            sharedValues.append(halo[:depth, theirs])
+        exchange.wait()
+        return sumByCell(np.concatenate(sharedCells), np.hstack(sharedValues))
+
+
+def _runTile(tile, bounds, config, storePath, stationaryCounts, startTime, seed, user, barrier, specs, results):
+    "A worker process: step one tile through the run, then put (tile, counts, error) on results."
+    exchange = Exchange.attach(barrier, specs)
+    try:
+        engine = TileEngine(config, tile, bounds, exchange, seed)
+        engine.populate(TrajectoryStore(storePath), stationaryCounts, startTime)
+        engine.infectUser(user)
+        counts = engine.run()
+        exchange.risk[engine.start:engine.stop] = engine.riskGrid[:engine.stop - engine.start]
+        results.put((tile, counts, None))
+    except Exception:
+        exchange.barrier.abort()  # don't leave the other workers waiting for this one
+        results.put((tile, None, traceback.format_exc()))
+    finally:
+        exchange.close()
+
+
+def runPartitioned(config, storePath, stationaryCounts=None, tiles=None, seed=None, startTime=None):
+    """
+    One run of config.length_of_sim timesteps, split into tiles bands of rows (as many as there are cores by default)
+    stepped by one process each. Bands are cut so that each holds about as many stationary humans. seed is the entropy
+    of the SeedSequence the tiles' random streams and the first case are drawn from.
+    Returns (counts, riskGrid), as runReplicate does.
+    """
+    geometry = config.geometry()
+    size = geometry.size
+    counts = np.zeros((size, size), dtype=np.int64) if stationaryCounts is None else np.asarray(stationaryCounts)
+    tiles = min(tiles or os.cpu_count() or 1, size)
+    bounds = tileBounds(counts.sum(axis=1), tiles)
+    store = TrajectoryStore(storePath)
+    users = len(store)
+    fields = len(Population(0, config, np.random.default_rng()).arrays()) + len(TRAVEL_FIELDS)
+    sequence = np.random.SeedSequence(seed)
+    seeds = sequence.spawn(tiles)
+    user = int(np.random.default_rng(sequence).integers(users))  # the first case, as ArrayEngine.seedInfection()
+
+    exchange = Exchange.create(tiles, size, users, fields)
+    results = multiprocessing.Queue()
+    workers = []
+    try:
+        for tile in range(tiles):
+            args = (tile, bounds, config, storePath, counts, startTime, seeds[tile], user, exchange.barrier,
+                    exchange.specs(), results)
+            if tiles == 1:
+                _runTile(*args)  # in this process
+            else:
+                workers.append(multiprocessing.Process(target=_runTile, args=args))
+                workers[-1].start()
+        tileCounts = {}
+        while len(tileCounts) < tiles:
+            try:
+                tile, result, error = results.get(timeout=1)
+            except queue.Empty:
+                if any(worker.exitcode not in (None, 0) for worker in workers):
+                    raise RuntimeError("A partitioned run's worker died")
+                continue
+            if error is not None:
+                raise RuntimeError("Tile %d failed:\n%s" % (tile, error))
+            tileCounts[tile] = result
+        riskGrid = exchange.risk.copy()
+    finally:
+        for worker in workers:
+            worker.join(timeout=1)
+            if worker.is_alive():
+                worker.terminate()
+        exchange.close(unlink=True)
+    names = tileCounts[0].keys()
+    return dict((name, sum(tileCounts[tile][name] for tile in range(tiles))) for name in names), riskGrid
@@ -0,0 +1,162 @@
+"""
+Struct-of-arrays population. Every per-person attribute of the script's Human class is one NumPy array here,
+indexed by agent number, so that deaths, recoveries and risk tallies are batched array operations. Incubation and
+illness end at times scheduled in an EventQueue when a human is infected. Events name humans by id rather than by
+index, so humans can be dropped or added (as a partitioned run does) without scheduling anyone's events again.
+"""
+import numpy as np
+
+from episim.schedule import INCUBATED, RESOLVED, EventQueue
+
+
+class Population(object):
+
+    def __init__(self, size, config, rng):
+        self.size = size
+        self.config = config
+        self.id = np.arange(size)  # stable, ascending: what events name humans by
+        self.nextId = size  # the id the next human added gets
+        self.rng = rng
+        self.lat = np.zeros(size)
+        self.lon = np.zeros(size)
+        self.cellA = np.zeros(size, dtype=np.int64)  # flat grid A index
+        self.cellB = np.zeros(size, dtype=np.int64)  # flat grid B index
+        self.mobile = np.zeros(size, dtype=bool)  # True for Geolife humans, False for stationary NASA ones
+        self.alive = np.ones(size, dtype=bool)
+        self.dead = np.zeros(size, dtype=bool)  # killed by the virus, as opposed to running out of trajectories
+        self.infected = np.zeros(size, dtype=bool)
+        self.wasInfected = np.zeros(size, dtype=bool)  # infected at any point in the run
+        self.confirmed = np.zeros(size, dtype=bool)  # has a CDC code
+        self.immune = np.zeros(size, dtype=bool)
+        self.quarantined = np.zeros(size, dtype=bool)
+        self.contagious = np.zeros(size, dtype=bool)  # infected and past incubation
+        self.incubationEnds = np.full(size, np.nan)  # when the current infection's incubation ends...
+        self.infectionEnds = np.full(size, np.nan)  # ...and when it ends in death or recovery
+        self.time = 0  # the time infections happen at; set by progress()
+        self.events = EventQueue()
+        self.prob = np.zeros(size)
+        self.age = rng.normal(config.age_mean, config.age_stddev, size)
+        self.usingApp = rng.random(size) < config.app_adoption
+
+    def arrays(self):
+        "Attribute name -> array, for every per-human attribute."
+        return dict((name, value) for name, value in vars(self).items() if isinstance(value, np.ndarray))
+
+    def select(self, index):
+        """
+        Keep only the humans at index (ascending), renumbered in that order. The events of the others are left in the
+        queue, and skipped when they come due.
+        """
+        for name, value in self.arrays().items():
+            setattr(self, name, value[index])
+        self.size = len(self.alive)
+
+    def extend(self, arrays):
+        """
+        Add humans given as arrays() of their attributes, with their infections carrying on where they were.
+        They get new ids, and only their own events are scheduled.
+        """
+        first = self.size
+        for name, value in self.arrays().items():
+            setattr(self, name, np.concatenate([value, arrays[name].astype(value.dtype)]))
+        self.size = len(self.alive)
+        self.id[first:] = np.arange(self.nextId, self.nextId + self.size - first)
+        self.nextId += self.size - first
+        self._schedule(np.arange(first, self.size))
+
+    def _schedule(self, index):
+        "Push the events still to come of the infected humans among index."
+        index = index[self.alive[index] & self.infected[index]]
+        for kind, ends in ((INCUBATED, self.incubationEnds), (RESOLVED, self.infectionEnds)):
+            pending = index if kind == RESOLVED else index[~self.contagious[index]]
+            times, which = np.unique(ends[pending], return_inverse=True)
+            order = np.argsort(which, kind="stable")
+            for time, agents in zip(times, np.split(pending[order], np.cumsum(np.bincount(which))[:-1])):
+                self.events.push(float(time), kind, self.id[agents])
+
+    def indexOf(self, ids):
+        "The indices of the humans with the given ids, leaving out ids no human here has any more."
+        if self.size == 0:
+            return np.zeros(0, dtype=np.int64)
+        index = np.minimum(np.searchsorted(self.id, ids), self.size - 1)
+        return index[self.id[index] == ids]
+
+    def place(self, index, lat, lon, geometry):
+        self.lat[index] = lat
+        self.lon[index] = lon
+        self.cellA[index], self.cellB[index] = geometry.gridify(lat, lon)
+
+    def infectious(self):
+        "Mask of humans who can spread the virus: alive, infected and past incubation."
+        return self.alive & self.infected & self.contagious
+
+    def infect(self, index, confirmed=False):
+        """
+        Infect the humans at index (an index array or mask). Confirmed cases get probability 1 and, if they use the app, quarantine.
+        Returns the indices that were newly infected.
+        """
+        index = np.flatnonzero(index) if np.asarray(index).dtype == bool else np.unique(index)
+        if confirmed:
+            self.confirmed[index] = True
+            self.prob[index] = 1
+            self.quarantined[index] |= self.usingApp[index]
+        fresh = index[self.alive[index] & ~self.infected[index]]  # as in Human.infect, immunity doesn't stop reinfection
+        self.infected[fresh] = True
+        self.wasInfected[fresh] = True
+        incubated = self.time + self.config.incubation_time
+        resolved = incubated + self.config.infection_duration
+        self.incubationEnds[fresh] = incubated
+        self.infectionEnds[fresh] = resolved
+        self.events.push(incubated, INCUBATED, self.id[fresh])
+        self.events.push(resolved, RESOLVED, self.id[fresh])
+        return fresh
+
+    def progress(self, time, riskGrid):
+        """
+        Disease progression up to time: infected humans add to the risk of their grid A cell, then the incubation and
+        infection periods that have ended by time take effect, in the order they ended.
+        Returns the indices of humans who died.
+        """
+        self.time = time
+        sick = self.alive & self.infected
+        cells, counts = np.unique(self.cellA[sick], return_counts=True)
+        riskGrid.ravel()[cells] += counts
+        dead = []
+        for eventTime, kind, ids in self.events.due(time):
+            agents = self.indexOf(ids)
+            if kind == INCUBATED:
+                # Events of humans who have since died, left or recovered (and perhaps been infected again) are stale.
+                agents = agents[self.alive[agents] & self.infected[agents] & (self.incubationEnds[agents] == eventTime)]
+                self.contagious[agents] = True
+            else:
+                agents = agents[self.alive[agents] & self.infected[agents] & (self.infectionEnds[agents] == eventTime)]
+                dead.append(self._resolve(agents))
+        return np.concatenate(dead) if dead else np.zeros(0, dtype=np.int64)
+
+    def _resolve(self, done):
+        "The infections of done are over: each human dies, or recovers and perhaps becomes immune."
+        config = self.config
+        # Older people are more likely to die from the virus; age is a linear factor, as in Human.stepTo.
+        dies = self.rng.random(len(done)) < config.fatality_rate * self.age[done] / config.age_mean
+        dead = done[dies]
+        self.alive[dead] = False
+        self.dead[dead] = True
+        recovered = done[~dies]
+        self.infected[recovered] = False
+        self.contagious[recovered] = False
+        self.prob[recovered] = 0
+        becomesImmune = self.rng.random(len(recovered)) < config.immunity
+        self.immune[recovered[becomesImmune]] = True
+        return dead
+
+    def counts(self):
+        "Epidemic statistics for the population."
+        return {
+            "humans": self.size,
+            "cases": int(np.count_nonzero(self.wasInfected)),
+            "infected": int(np.count_nonzero(self.alive & self.infected)),
+            "immune": int(np.count_nonzero(self.alive & self.immune)),
+            "dead": int(np.count_nonzero(self.dead)),
+            "departed": int(np.count_nonzero(~self.alive & ~self.dead)),  # Geolife humans whose trajectories ran out
+            "quarantined": int(np.count_nonzero(self.alive & self.quarantined)),
+        }
@@ -0,0 +1,111 @@
+"""
+Per-timestep instrumentation: how long each phase of a step takes and counters of the work it did (humans stepped,
+fixes consumed, contacts, infections, published IDs). A Profiler collects one row per step, exportable as CSV or
+JSON. Engines are given NULL_PROFILER by default, whose methods do nothing, so instrumentation costs a few method
+calls per step when it is off.
+"""
+import csv
+import json
+import time
+
+
+class _Timer(object):
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+
+
+class Profiler(object):
+    "Collects phase times (in seconds) and counters for each step, and in total."
+    enabled = True
+
+    def __init__(self):
+        self.rows = []  # one dict per step: step, time, then phase times and counters
+        self.current = {}
+        self.phases = []  # phase and counter names, in the order first seen
+        self.totals = {}
+
+    def phase(self, name):
+        "A context manager timing a phase of the current step: with profiler.phase(\"move\"): ..."
+        return _Timer(self, name)
+
+    def add(self, name, value):
+        "Add to a phase's time or a counter in the current step."
+        if name not in self.totals:
+            self.phases.append(name)
+            self.totals[name] = 0
+        self.current[name] = self.current.get(name, 0) + value
+        self.totals[name] += value
+
+    count = add
+
+    def set(self, name, value):
+        "Set a gauge, such as a database size, for the current step; its total is its latest value."
+        if name not in self.totals:
+            self.phases.append(name)
+        self.current[name] = value
+        self.totals[name] = value
+
+    def endStep(self, time):
+        "Finish the current step's row, at simulation time time."
+        row = {"step": len(self.rows), "time": time}
+        row.update(self.current)
+        self.rows.append(row)
+        self.current = {}
+
+    def toCsv(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, ["step", "time"] + self.phases, restval=0)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def toJson(self, path):
+        with open(path, "w") as f:
+            json.dump({"totals": self.totals, "steps": self.rows}, f)
+
+    def write(self, path):
+        "toCsv() or toJson(), by path's extension."
+        if path.endswith(".json"):
+            self.toJson(path)
+        else:
+            self.toCsv(path)
+
+    def summary(self):
+        "Total time and count per phase or counter, largest first."
+        return sorted(self.totals.items(), key=lambda item: -item[1])
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+class NullProfiler(object):
+    "A Profiler that records nothing."
+    enabled = False
+    _timer = _NullTimer()
+
+    def phase(self, name):
+        return self._timer
+
+    def add(self, name, value):
+        pass
+
+    count = set = add
+
+    def endStep(self, time):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,55 @@
+"""
+Turning risk grids into heatmap overlays with whole-array operations: risk is log-scaled and normalised to 0-255,
+mapped through a colour lookup table, and converted to an image in one go, so grids thousands of cells a side and
+long runs of frames need no per-pixel Python loops.
+"""
+import numpy as np
+
+
+def riskLevels(riskGrid, riskiest=None):
+    """
+    Scales risk to 0-255: log10 of each cell's risk (0 where there is none), divided by riskiest + 1.
+    riskiest defaults to the highest log10 risk in the grid; give the same value for every frame of an animation.
+    """
+    risk = np.asarray(riskGrid, dtype=np.float64)
+    logged = np.zeros(risk.shape)
+    positive = risk > 0
+    np.log10(risk, out=logged, where=positive)
+    np.maximum(logged, 0, out=logged)  # averaged grids can have risks below 1
+    if riskiest is None:
+        riskiest = logged.max() if logged.size else 0
+    return (logged / (riskiest + 1) * 255).astype(np.uint8)
+
+
+def redLut(alpha=128):
+    "The heatmap's colours: level 0 is transparent, level v is (255, v, v) at the given alpha, so higher risk is paler."
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    levels = np.arange(1, 256)
+    lut[1:] = np.stack([np.full(255, 255), levels, levels, np.full(255, alpha)], axis=1)
+    lut[0] = (255, 255, 255, 0)
+    return lut
+
+
+def overlay(riskGrid, lut=None, riskiest=None):
+    "RGBA pixels (height x width x 4, uint8) for a risk grid, with north at the top."
+    if lut is None:
+        lut = redLut()
+    return lut[riskLevels(riskGrid, riskiest)][::-1]
+
+
+def overlayImage(riskGrid, size=None, lut=None, riskiest=None):
+    "overlay() as a PIL image, resized to size (width, height) if given."
+    from PIL import Image
+    image = Image.fromarray(np.ascontiguousarray(overlay(riskGrid, lut, riskiest)), "RGBA")
+    return image if size is None else image.resize(size)
+
+
+def frames(riskGrids, size=None, lut=None, riskiest=None):
+    """
+    overlayImage() for each grid of a sequence (such as a stack of snapshots), all scaled to the same riskiest:
+    by default the highest log10 risk of any frame.
+    """
+    if riskiest is None:
+        riskiest = max((np.log10(np.max(grid)) for grid in riskGrids if np.max(grid) > 1), default=0)
+    for grid in riskGrids:
+        yield overlayImage(grid, size, lut, riskiest)
@@ -0,0 +1,35 @@
+"""
+A priority queue of disease progression events. When humans are infected, the times their incubation and illness end
+are pushed once, and each step only pops the events that have come due, instead of running every infected human's
+timers down by the step size. Humans infected together share their event times, so an event holds an array of them.
+"""
+import heapq
+
+import numpy as np
+
+INCUBATED = 0  # incubation is over: the human becomes infectious
+RESOLVED = 1  # the infection is over: the human dies or recovers
+
+
+class EventQueue(object):
+
+    def __init__(self):
+        self.heap = []  # (time, sequence number, kind, agents)
+        self.sequence = 0  # how many events have been pushed; keeps events pushed at the same time in order
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, time, kind, agents):
+        if len(agents):
+            heapq.heappush(self.heap, (time, self.sequence, kind, np.asarray(agents)))
+            self.sequence += 1
+
+    def due(self, time):
+        "Pop the events at or before time, earliest first, as (time, kind, agents)."
+        while self.heap and self.heap[0][0] <= time:
+            eventTime, sequence, kind, agents = heapq.heappop(self.heap)
+            yield eventTime, kind, agents
+
+    def nextTime(self):
+        return self.heap[0][0] if self.heap else None
@@ -0,0 +1,104 @@
+"""
+The simulation as a library: a Simulation holds a Config and its loaded inputs (the TrajectoryStore and the NASA
+population densities of the grid's window), and runs the array engine on them with no module-level state, so one
+process can build and run many configurations without reloading data. Rendering and network dependencies are only
+imported by the functions that draw maps.
+"""
+import hashlib
+
+from episim.density import DensityRaster, humanCounts
+from episim.engine import ArrayEngine
+from episim.ensemble import runEnsemble
+from episim.partition import runPartitioned
+from episim.trajectories import TrajectoryStore
+
+GEOMETRY_PARAMETERS = ("grid_size", "min_lat", "min_lon", "lat_step", "lon_step")
+
+
+class Simulation(object):
+    """
+    store is a TrajectoryStore of the Geolife humans; densities is the grid_size x grid_size window of the NASA dataset
+    over the grid (None for no stationary humans). The simulation starts at startTime, by default when the first
+    Geolife human's trajectories do.
+    """
+
+    def __init__(self, config, store, densities=None, startTime=None):
+        self.config = config
+        self.store = store
+        self.densities = densities
+        self.startTime = startTime
+
+    @classmethod
+    def load(cls, config, geolifePath, popDensityPath=None, trajectoryCache="geolife-cache", densityCache="gpw-cache",
+             startTime=None):
+        "Load the inputs from the Geolife and NASA datasets, through their caches (see TrajectoryStore and DensityRaster)."
+        store = TrajectoryStore.cached(geolifePath, trajectoryCache)
+        densities = None
+        if popDensityPath is not None:
+            densities = DensityRaster(popDensityPath, densityCache).gridWindow(config.geometry())
+        return cls(config, store, densities, startTime)
+
+    def withConfig(self, **changes):
+        "A Simulation of the same inputs with some parameters changed; the grid itself can't change."
+        moved = [name for name in GEOMETRY_PARAMETERS if name in changes and changes[name] != getattr(self.config, name)]
+        if moved and self.densities is not None:
+            raise ValueError("Changing " + ", ".join(moved) + " needs the population densities loaded again")
+        return Simulation(self.config.copy(**changes), self.store, self.densities, self.startTime)
+
+    def fingerprint(self):
+        "A hash of the inputs: the Geolife files the store was built from, the densities and the start time."
+        digest = hashlib.sha1()
+        digest.update(repr((self.store.manifest.get("fingerprint"), self.startTime)).encode())
+        if self.densities is not None:
+            digest.update(self.densities.tobytes())
+        return digest.hexdigest()
+
+    def stationaryCounts(self):
+        "How many stationary humans stand in each grid A square, or None."
+        if self.densities is None:
+            return None
+        return humanCounts(self.densities, self.config.density_to_humans)
+
+    def engine(self, seed=None, profiler=None):
+        "A populated ArrayEngine with one Geolife human infected, ready to run."
+        engine = ArrayEngine(self.config, seed, profiler)
+        engine.populate(self.store, self.stationaryCounts(), self.startTime)
+        engine.seedInfection()
+        return engine
+
+    def run(self, seed=None, snapshots=None, profiler=None, checkpoints=None):
+        """
+        One run of config.length_of_sim timesteps; returns the engine, with its counts() and riskGrid.
+        profiler is an optional episim.profile.Profiler to record each step's phases in, and checkpoints an optional
+        episim.checkpoint.Checkpointer.
+        """
+        engine = self.engine(seed, profiler)
+        engine.run(snapshots=snapshots, checkpoints=checkpoints)
+        return engine
+
+    def ensemble(self, replicates, seed=None, processes=None, snapshotPath=None, snapshotInterval=1.):
+        "replicates independent runs across a process pool; see runEnsemble."
+        return runEnsemble(self.config, self.store.path, self.stationaryCounts(), replicates, seed, processes,
+                           self.startTime, snapshotPath, snapshotInterval)
+
+    def partitioned(self, tiles=None, seed=None):
+        "One run split into tiles bands of rows stepped by one process each; see runPartitioned. Returns (counts, riskGrid)."
+        return runPartitioned(self.config, self.store.path, self.stationaryCounts(), tiles, seed, self.startTime)
+
+
+def heatmap(riskGrid, config, path, mapSource=None, mapCache="map-cache", mapPath=None):
+    """
+    Save riskGrid over a background map as an image at path, and the map alone at mapPath if given. mapSource is a
+    source from episim.basemap, by default a BlankSource, so no network access is needed.
+    """
+    from PIL import Image, ImageOps
+    from episim.basemap import BlankSource, basemap, overlaySize
+    from episim.render import overlayImage
+    geometry = config.geometry()
+    bbox = [[geometry.min_lat, geometry.min_lon], [geometry.max_lat, geometry.max_lon]]
+    background, view = basemap(bbox, BlankSource() if mapSource is None else mapSource, mapCache)
+    if mapPath is not None:
+        background.save(mapPath)
+    img = overlayImage(riskGrid, size=overlaySize(view))
+    background = ImageOps.fit(background, size=img.size, centering=(0.5, 0.5))
+    Image.alpha_composite(background, img).save(path)
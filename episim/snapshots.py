@@ -0,0 +1,178 @@
+"""
+Time series of per-cell grids (risk, infected humans) written while a simulation runs.
+
+Every interval days a frame is taken of each layer, stored sparsely as the cells that changed since the layer's previous
+frame and by how much. Frames are buffered a chunk at a time and written as compressed .npz files next to a
+manifest.json, so a long run holds at most one chunk in memory. exportViewerJson() turns a snapshot directory into the
+JSON read by the heatmap viewer in geolife-density-time-grid/www.
+"""
+import json
+import os
+
+import numpy as np
+
+GEOLIFE_EPOCH_UNIX_DAYS = 25569  # Geolife times are days since 1899-12-30; Unix time starts 25569 days later.
+KM_PER_DEGREE = 111.32
+
+
+def unixTime(geolifeTime):
+    return int(round((geolifeTime - GEOLIFE_EPOCH_UNIX_DAYS) * 86400))
+
+
+class SnapshotWriter(object):
+    """
+    Writes frames of the named layers to the directory path. Call record() every step; a frame is taken whenever
+    interval days have passed since the last one. Call close() (or use a with block) at the end of the run: it takes a
+    last frame of the layers last given to record(), if they weren't already, and writes the last chunk. Layers are
+    kept by reference until then, so the final frame is the final state of a run whose grids are updated in place.
+    """
+
+    def __init__(self, path, geometry, interval=1., framesPerChunk=64):
+        self.path = path
+        self.geometry = geometry
+        self.interval = interval
+        self.framesPerChunk = framesPerChunk
+        self.nextTime = None
+        self.latest = None  # (time, layers) of the last record() that didn't take a frame
+        self.previous = {}  # layer name -> its grid at the last frame, flat
+        self.chunks = []
+        self.frames = 0
+        self._clear()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _clear(self):
+        self.times = []
+        self.cells = {}  # layer name -> list of the changed cells of each buffered frame
+        self.values = {}  # layer name -> list of their changes
+
+    def record(self, time, layers):
+        "Take a frame of layers (name -> grid_size x grid_size array) if an interval has passed since the last."
+        if self.nextTime is not None and time < self.nextTime:
+            self.latest = (time, layers)
+            return False
+        self.nextTime = time + self.interval
+        self._take(time, layers)
+        return True
+
+    def _take(self, time, layers):
+        self.latest = None
+        self.times.append(time)
+        for name, grid in layers.items():
+            grid = np.asarray(grid, dtype=np.float64).ravel()
+            previous = self.previous.get(name)
+            delta = grid if previous is None else grid - previous
+            changed = np.flatnonzero(delta)
+            self.cells.setdefault(name, []).append(changed.astype(np.uint32))
+            self.values.setdefault(name, []).append(delta[changed].astype(np.float32))
+            self.previous[name] = grid.copy()
+        self.frames += 1
+        if len(self.times) >= self.framesPerChunk:
+            self.flush()
+
+    def flush(self):
+        "Write the buffered frames as the next chunk."
+        if not self.times:
+            return
+        arrays = {"times": np.array(self.times)}
+        for name in self.cells:
+            arrays[name + "_offsets"] = np.cumsum([0] + [len(cells) for cells in self.cells[name]])
+            arrays[name + "_cells"] = np.concatenate(self.cells[name])
+            arrays[name + "_values"] = np.concatenate(self.values[name])
+        chunk = "chunk-%05d.npz" % len(self.chunks)
+        np.savez_compressed(os.path.join(self.path, chunk), **arrays)
+        self.chunks.append(chunk)
+        self._clear()
+        self._writeManifest()
+
+    def _writeManifest(self):
+        geometry = self.geometry
+        manifest = {"min_lat": geometry.min_lat, "min_lon": geometry.min_lon, "lat_step": geometry.lat_step,
+                    "lon_step": geometry.lon_step, "grid_size": geometry.size, "interval": self.interval,
+                    "layers": sorted(self.previous), "frames": self.frames, "chunks": self.chunks}
+        with open(os.path.join(self.path, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+
+    def close(self):
+        if self.latest is not None:
+            self._take(*self.latest)
+        self.flush()
+        self._writeManifest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SnapshotReader(object):
+    "Reads back a directory written by SnapshotWriter, one chunk at a time."
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.size = self.manifest["grid_size"]
+        self.layers = self.manifest["layers"]
+
+    def __len__(self):
+        return self.manifest["frames"]
+
+    def deltas(self, layer):
+        "Yields (time, cells, changes) for each frame of layer: the flat indices of the cells that changed, and by how much."
+        for chunk in self.manifest["chunks"]:
+            with np.load(os.path.join(self.path, chunk)) as arrays:
+                times = arrays["times"]
+                offsets = arrays[layer + "_offsets"]
+                cells = arrays[layer + "_cells"]
+                values = arrays[layer + "_values"]
+            for k in range(len(times)):
+                yield float(times[k]), cells[offsets[k]:offsets[k + 1]], values[offsets[k]:offsets[k + 1]]
+
+    def grids(self, layer):
+        "Yields (time, grid) for each frame of layer, rebuilding each grid_size x grid_size grid from the deltas."
+        grid = np.zeros(self.size * self.size)
+        for time, cells, values in self.deltas(layer):
+            grid[cells] += values
+            yield time, grid.reshape(self.size, self.size).copy()
+
+    def cellCentres(self, cells):
+        "Latitudes and longitudes of the centres of grid A cells, from their flat indices."
+        manifest = self.manifest
+        latIndex, lonIndex = np.divmod(cells, self.size)
+        return (manifest["min_lat"] + (latIndex + .5) * manifest["lat_step"],
+                manifest["min_lon"] + (lonIndex + .5) * manifest["lon_step"])
+
+
+def exportViewerJson(snapshotPath, outPath, layer="risk", increments=True, precision=5):
+    """
+    Writes a snapshot layer as the viewer's time_series_sparse_geospatial_tallies.json: for each frame, its Unix time
+    and the cells with each tally, as [tally, [[lat, lon], ...]] from the highest tally down. With increments, a
+    frame's tallies are how much each cell grew since the previous frame (right for risk, which only accumulates);
+    otherwise they are the layer's values at that frame. Frames are written one at a time, without indentation.
+    """
+    reader = SnapshotReader(snapshotPath)
+    manifest = reader.manifest
+    highest = 0
+    with open(outPath, "w") as f:
+        gridparams = {"spatial-cell-size-km": round(manifest["lat_step"] * KM_PER_DEGREE, 3),
+                      "timestep-size-seconds": int(round(manifest["interval"] * 86400))}
+        f.write('{"gridparams":%s,"timeseries":[' % json.dumps(gridparams, separators=(",", ":")))
+        frames = reader.deltas(layer) if increments else ((time, np.flatnonzero(grid), grid.ravel()[np.flatnonzero(grid)])
+                                                           for time, grid in reader.grids(layer))
+        for k, (time, cells, values) in enumerate(frames):
+            tallies = np.round(values).astype(np.int64)
+            keep = tallies > 0
+            cells, tallies = cells[keep], tallies[keep]
+            lats, lons = reader.cellCentres(cells)
+            order = np.argsort(-tallies, kind="stable")
+            groups = []
+            for tally in np.unique(tallies)[::-1]:
+                inTally = order[tallies[order] == tally]
+                groups.append([int(tally), [[round(float(lats[c]), precision), round(float(lons[c]), precision)]
+                                            for c in inTally]])
+            if len(tallies):
+                highest = max(highest, int(tallies.max()))
+            f.write(("," if k else "") + json.dumps([unixTime(time), groups], separators=(",", ":")))
+        f.write('],"ranges":{"tally":%d}}' % highest)
@@ -0,0 +1,221 @@
+"""
+Parameter sweeps for exploring and calibrating the model.
+
+Points come from a grid (every combination of listed values) or a Latin hypercube over ranges; each point is run with
+every seed, so points are compared on the same random numbers. Workers load a Simulation's inputs once and run points
+as they are handed out. A run stops early once its epidemic has died out, since nothing but departures can change after
+that. Results are cached on disk keyed by (parameters, seed, data fingerprint), so repeating a sweep, or extending one
+with more points, only runs what is new.
+
+    python -m episim.sweep --geolife Data --grid contact_rate=.1,.2,.4 --lhs immunity=.5:.9 --samples 8 --seeds 4
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from episim.config import Config
+from episim.simulation import GEOMETRY_PARAMETERS, Simulation
+from episim.trajectories import TrajectoryStore
+
+_inputs = {}  # per-worker: the Simulation every point shares, set up once by _initWorker
+RESULT_VERSION = 3  # part of every cache key; bumped when runs change, so results cached before are run again
+
+
+def gridPoints(values):
+    "Every combination of values (parameter name -> list of values), as a list of parameter dicts."
+    names = sorted(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+
+def latinHypercube(ranges, samples, seed=None):
+    """
+    samples parameter dicts spread over ranges (parameter name -> (low, high)) by Latin hypercube sampling: each
+    parameter's range is cut into samples equal strata, and each stratum is used exactly once.
+    """
+    rng = np.random.default_rng(seed)
+    names = sorted(ranges)
+    points = [{} for k in range(samples)]
+    for name in names:
+        low, high = ranges[name]
+        strata = (rng.permutation(samples) + rng.random(samples)) / samples
+        for point, u in zip(points, strata):
+            point[name] = float(low + u * (high - low))
+    return points
+
+
+def combine(*pointLists):
+    "Every point of each list merged with every point of the others, e.g. a grid crossed with a hypercube."
+    return [dict(kv for point in combination for kv in point.items()) for combination in itertools.product(*pointLists)]
+
+
+class ResultCache(object):
+    "Run results as JSON files in cacheDir, keyed by the full Config, the seed and the data fingerprint."
+
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+
+    @staticmethod
+    def key(config, seed, fingerprint):
+        key = [RESULT_VERSION, config.asDict(), seed, fingerprint]
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        path = os.path.join(self.cacheDir, key + ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def put(self, key, result):
+        path = os.path.join(self.cacheDir, key + ".json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(result, f)
+        os.replace(path + ".tmp", path)
+
+
+def runPoint(simulation, params, seed, checkEvery=10):
+    """
+    Run one point with one seed, checking every checkEvery steps whether the epidemic has died out and stopping if so.
+    Returns the run's counts, how many steps it ran, and whether it stopped early.
+    """
+    point = simulation.withConfig(**params)  # refuses to move the grid away from the loaded densities
+    config = point.config
+    engine = point.engine(seed)
+    stopped = False
+    while engine.steps < config.length_of_sim:  # counted in steps, as ArrayEngine.run() does
+        engine.run(min(checkEvery, config.length_of_sim - engine.steps))
+        if engine.extinct():
+            stopped = engine.steps < config.length_of_sim
+            break
+    return {"counts": engine.counts(), "steps": engine.steps, "stoppedEarly": stopped}
+
+
+def _initWorker(config, storePath, densities, startTime, checkEvery):
+    _inputs["simulation"] = Simulation(config, TrajectoryStore(storePath), densities, startTime)
+    _inputs["checkEvery"] = checkEvery
+
+
+def _runJob(job):
+    index, params, seed = job
+    return index, runPoint(_inputs["simulation"], params, seed, _inputs["checkEvery"])
+
+
+def sweep(simulation, points, seeds=(0,), cacheDir=None, processes=None, checkEvery=10):
+    """
+    Run every point (a dict of Config parameters changed from simulation.config) with every seed, across a pool of
+    processes (all cores by default; 1 runs in this process). Returns one row per (point, seed), in order: a dict of
+    its params, seed, counts, steps, stoppedEarly and whether it came from the cache. Finished runs are cached as they
+    arrive, so an interrupted sweep picks up where it stopped. Points that move the grid away from the loaded densities
+    raise a ValueError before anything runs.
+    """
+    cache = ResultCache(cacheDir) if cacheDir is not None else None
+    fingerprint = simulation.fingerprint()
+    rows = []
+    jobs = []
+    keys = {}
+    for params in points:
+        for seed in seeds:
+            row = {"params": dict(params), "seed": seed, "cached": False}
+            rows.append(row)
+            key = ResultCache.key(simulation.withConfig(**params).config, seed, fingerprint)
+            result = cache.get(key) if cache is not None else None
+            if result is not None:
+                row.update(result, cached=True)
+            else:
+                keys[len(rows) - 1] = key
+                jobs.append((len(rows) - 1, params, seed))
+    if not jobs:
+        return rows
+    initArgs = (simulation.config, simulation.store.path, simulation.densities, simulation.startTime, checkEvery)
+    if processes == 1:
+        _initWorker(*initArgs)
+        finished = map(_runJob, jobs)
+    else:
+        pool = multiprocessing.Pool(processes, _initWorker, initArgs)
+        finished = pool.imap_unordered(_runJob, jobs)
+    try:
+        for index, result in finished:
+            rows[index].update(result)
+            if cache is not None:
+                cache.put(keys[index], result)
+    finally:
+        if processes != 1:
+            pool.close()
+            pool.join()
+    return rows
+
+
+def calibrate(rows, observed, outcome="cases"):
+    """
+    Rank the swept points by how far their mean outcome (across seeds) is from an observed value, such as a case count.
+    Returns (error, mean, params) tuples, closest first.
+    """
+    byPoint = {}
+    for row in rows:
+        byPoint.setdefault(json.dumps(row["params"], sort_keys=True), []).append(row["counts"][outcome])
+    ranked = []
+    for params, values in byPoint.items():
+        mean = float(np.mean(values))
+        ranked.append((abs(mean - observed), mean, json.loads(params)))
+    ranked.sort(key=lambda entry: entry[0])
+    return ranked
+
+
+def _parseValues(assignment):
+    name, _, values = assignment.partition("=")
+    return name.strip(), [Config.parse([name + "=" + value]).asDict()[name.strip()] for value in values.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--geolife", default=os.environ.get("GEOLIFE_PATH"), help="Geolife Data directory ($GEOLIFE_PATH)")
+    parser.add_argument("--popdensity", default=os.environ.get("POPDENSITY_PATH"), help="NASA GPWv4 .asc directory")
+    parser.add_argument("--trajectory-cache", default="geolife-cache")
+    parser.add_argument("--density-cache", default="gpw-cache")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="a fixed Config parameter")
+    parser.add_argument("--grid", action="append", default=[], metavar="NAME=V1,V2,...", help="values to try")
+    parser.add_argument("--lhs", action="append", default=[], metavar="NAME=LOW:HIGH", help="a range to sample")
+    parser.add_argument("--samples", type=int, default=10, help="Latin hypercube samples")
+    parser.add_argument("--seeds", type=int, default=1, help="runs per point, with seeds 0, 1, ...")
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--cache", default="sweep-cache", help="result cache directory")
+    parser.add_argument("--observed", type=float, help="observed case count to rank points against")
+    args = parser.parse_args()
+    if args.geolife is None:
+        parser.error("--geolife (or $GEOLIFE_PATH) is required")
+
+    pointLists = []
+    if args.grid:
+        pointLists.append(gridPoints(dict(_parseValues(assignment) for assignment in args.grid)))
+    if args.lhs:
+        ranges = {}
+        for assignment in args.lhs:
+            name, _, bounds = assignment.partition("=")
+            low, high = bounds.split(":")
+            ranges[name.strip()] = (float(low), float(high))
+        pointLists.append(latinHypercube(ranges, args.samples, seed=0))
+    points = combine(*pointLists) if pointLists else [{}]
+    moved = sorted(set(name for point in points for name in point) & set(GEOMETRY_PARAMETERS))
+    if moved and args.popdensity is not None:
+        parser.error("can't sweep " + ", ".join(moved) + ": the population densities are loaded for one grid")
+
+    simulation = Simulation.load(Config.parse(args.set), args.geolife, args.popdensity, args.trajectory_cache,
+                                 args.density_cache)
+    rows = sweep(simulation, points, range(args.seeds), args.cache, args.processes)
+    for row in rows:
+        print(json.dumps(row["params"], sort_keys=True), "seed", row["seed"], row["counts"],
+              "steps", row["steps"], "(cached)" if row["cached"] else "")
+    if args.observed is not None:
+        for error, mean, params in calibrate(rows, args.observed)[:10]:
+            print("error", error, "mean cases", mean, json.dumps(params, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
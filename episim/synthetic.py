@@ -0,0 +1,65 @@
+"""
+Synthetic data in the Geolife format, so the engines can be run and benchmarked without the real dataset.
+"""
+import datetime
+import os
+
+import numpy as np
+
+GEOLIFE_EPOCH = datetime.datetime(1899, 12, 30)  # Geolife times are days since this date
+
+
+def writeGeolife(basePath, geometry, users=20, trajectories=2, fixes=500, interval=2, spread=20, startTime=39750.0, seed=0):
+    """
+    Write a Geolife-style Data directory: basePath/<user>/Trajectory/<timestamp>.plt, with random walks inside
+    a spread x spread block of cells in the middle of the grid. Fixes are interval seconds apart.
+    """
+    rng = np.random.default_rng(seed)
+    centerLat = geometry.min_lat + geometry.size * geometry.lat_step / 2
+    centerLon = geometry.min_lon + geometry.size * geometry.lon_step / 2
+    halfLat = spread * geometry.lat_step / 2
+    halfLon = spread * geometry.lon_step / 2
+    dt = interval / 86400.0
+    for user in range(users):
+        directory = os.path.join(basePath, "%03d" % user, "Trajectory")
+        os.makedirs(directory, exist_ok=True)
+        time = startTime + rng.random() * 10 * dt
+        lat = centerLat + rng.uniform(-halfLat, halfLat)
+        lon = centerLon + rng.uniform(-halfLon, halfLon)
+        for t in range(trajectories):
+            steps = rng.normal(0, geometry.lat_step / 20, (fixes, 2))
+            lats = np.clip(lat + np.cumsum(steps[:, 0]), centerLat - halfLat, centerLat + halfLat)
+            lons = np.clip(lon + np.cumsum(steps[:, 1]), centerLon - halfLon, centerLon + halfLon)
+            times = time + dt * np.arange(fixes)
+            stamp = GEOLIFE_EPOCH + datetime.timedelta(days=times[0])
+            with open(os.path.join(directory, stamp.strftime("%Y%m%d%H%M%S") + ".plt"), "w") as f:
+                f.write("Geolife trajectory\nWGS 84\nAltitude is in Feet\nReserved 3\n0,2,255,My Track,0,0,2,8421376\n0\n")
+                for i in range(fixes):
+                    moment = GEOLIFE_EPOCH + datetime.timedelta(days=times[i])
+                    f.write("%.6f,%.6f,0,%d,%.10f,%s,%s\n" % (lats[i], lons[i], 150, times[i],
+                                                               moment.strftime("%Y-%m-%d"), moment.strftime("%H:%M:%S")))
+            lat, lon = lats[-1], lons[-1]
+            time = times[-1] + dt * rng.integers(1, 30)  # a short gap before the next trajectory
+    return basePath
+
+
+def writeGpw(popDensityPath, cellsize=1.0, seed=0, nodataFraction=.05):
+    """
+    Write 8 .asc chunks laid out like NASA's GPWv4 (split at the equator, the prime meridian and +/-90 longitude),
+    each 90 degrees on a side at the given cell size, with random population counts.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(popDensityPath, exist_ok=True)
+    side = int(round(90 / cellsize))
+    chunk = 0
+    for south in (0, -90):
+        for west in (-180, -90, 0, 90):
+            chunk += 1
+            counts = rng.lognormal(3, 2, (side, side))
+            counts[rng.random((side, side)) < nodataFraction] = -9999
+            with open(os.path.join(popDensityPath, "gpw_v4_population_count_rev11_2020_30_sec_%d.asc" % chunk), "w") as f:
+                f.write("ncols         %d\nnrows         %d\nxllcorner     %d\nyllcorner     %d\ncellsize      %r\nNODATA_value  -9999\n"
+                        % (side, side, west, south, cellsize))
+                for row in counts:
+                    f.write(" ".join("%g" % value for value in row) + " \n")
+    return popDensityPath
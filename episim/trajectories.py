@@ -0,0 +1,117 @@
+"""
+Geolife trajectories. Each Geolife user has a Trajectory directory of .plt files with 6 header lines, then one comma
+separated fix per line: latitude, longitude, 0, altitude, days since 1899-12-30, date, time.
+
+Parsing that text is slow, so the whole Data directory is ingested once into a TrajectoryStore: a directory of .npy
+columns (float64 time, float32 lat/lon) with per-user offsets, which later runs memory-map instead of reading text.
+Each user's fixes are sorted by time, so finding where a user is at a given time is a binary search.
+"""
+import collections
+import hashlib
+import json
+import os
+
+import numpy as np
+
+Track = collections.namedtuple("Track", ["time", "lat", "lon"])  # one user's fixes, in order
+
+
+def userTrajectoryDirs(basePath):
+    "The Trajectory directory of every user under a Geolife Data directory, in user order."
+    return [basePath + "/" + user + "/Trajectory" for user in sorted(os.listdir(basePath))]
+
+
+def trajectoryFiles(trajectoryDir):
+    return sorted(trajectoryDir + "/" + traj for traj in os.listdir(trajectoryDir))  # timestamps sort chronologically
+
+
+def fingerprint(basePath):
+    "Hash of the name, size and modification time of every .plt file, to tell whether a store is out of date."
+    digest = hashlib.sha1()
+    for trajectoryDir in userTrajectoryDirs(basePath):
+        for path in trajectoryFiles(trajectoryDir):
+            stat = os.stat(path)
+            digest.update(("%s %d %d\n" % (os.path.relpath(path, basePath), stat.st_size, stat.st_mtime_ns)).encode())
+    return digest.hexdigest()
+
+
+def readPlt(path):
+    "The (time, lat, lon) columns of one .plt file."
+    fixes = np.loadtxt(path, delimiter=",", skiprows=6, usecols=(4, 0, 1), ndmin=2)
+    return fixes[:, 0], fixes[:, 1], fixes[:, 2]
+
+
+def seek(times, start, end, time):
+    """
+    For each segment times[start[k]:end[k]] (each sorted), the index of the first entry at or after time, or end[k] if
+    there is none. A binary search run on all segments at once: O(log n) vectorized passes, whatever the distance jumped.
+    """
+    low = np.array(start, dtype=np.int64)
+    high = np.array(end, dtype=np.int64)
+    searching = np.flatnonzero(low < high)
+    while len(searching):
+        middle = (low[searching] + high[searching]) // 2
+        before = times[middle] < time
+        low[searching[before]] = middle[before] + 1
+        high[searching[~before]] = middle[~before]
+        searching = searching[low[searching] < high[searching]]
+    return low
+
+
+class TrajectoryStore(object):
+    COLUMNS = ("offsets", "time", "lat", "lon")
+
+    def __init__(self, storePath):
+        "Open an ingested store; the columns are memory-mapped, not read."
+        self.path = storePath
+        with open(os.path.join(storePath, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.users = self.manifest["users"]
+        for column in self.COLUMNS:
+            setattr(self, column, np.load(os.path.join(storePath, column + ".npy"), mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.users)
+
+    def track(self, user):
+        start, end = self.offsets[user], self.offsets[user + 1]
+        return Track(self.time[start:end], self.lat[start:end], self.lon[start:end])
+
+    @classmethod
+    def ingest(cls, basePath, storePath):
+        "Convert a Geolife Data directory into a store at storePath, and open it."
+        users = []
+        columns = ([], [], [])
+        lengths = []
+        for trajectoryDir in userTrajectoryDirs(basePath):
+            users.append(os.path.basename(os.path.dirname(trajectoryDir)))
+            fixes = [readPlt(path) for path in trajectoryFiles(trajectoryDir)]
+            time, lat, lon = (np.concatenate(column) for column in zip(*fixes)) if fixes else (np.zeros(0),) * 3
+            order = np.argsort(time, kind="stable")  # overlapping trajectories would otherwise break searches
+            for column, values in zip(columns, (time, lat, lon)):
+                column.append(values[order])
+            lengths.append(len(time))
+        os.makedirs(storePath, exist_ok=True)
+        arrays = {
+            "offsets": np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))),
+            "time": np.concatenate(columns[0]) if users else np.zeros(0),
+            "lat": (np.concatenate(columns[1]) if users else np.zeros(0)).astype(np.float32),
+            "lon": (np.concatenate(columns[2]) if users else np.zeros(0)).astype(np.float32),
+        }
+        for column in cls.COLUMNS:
+            np.save(os.path.join(storePath, column + ".npy"), arrays[column])
+        with open(os.path.join(storePath, "manifest.json"), "w") as f:  # written last: a store without one is incomplete
+            json.dump({"source": os.path.abspath(basePath), "fingerprint": fingerprint(basePath), "users": users}, f)
+        return cls(storePath)
+
+    @classmethod
+    def cached(cls, basePath, storePath):
+        "Open the store at storePath, ingesting basePath into it first if it is missing or out of date."
+        try:
+            with open(os.path.join(storePath, "manifest.json")) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        if manifest.get("fingerprint") != fingerprint(basePath):
+            return cls.ingest(basePath, storePath)
+        return cls(storePath)
@@ -0,0 +1,33 @@
+import numpy as np
+
+from episim.config import Config
+from episim.engine import ArrayEngine
+from episim.exposure import newTokens
+from episim.population import Population
+
+
+def appEngine(size):
+    "An ArrayEngine whose size humans all use the app, and have met no one yet."
+    engine = ArrayEngine(Config(app_adoption=1), seed=0)
+    engine.population = Population(size, engine.config, engine.rng)
+    return engine
+
+
+def test_published_user_is_not_exposed_by_own_tokens():
+    engine = appEngine(2)
+    engine.exposures.record(np.array([0]), np.array([1]), newTokens(engine.rng, 1))
+    engine.confirm([0])
+    engine._checkExposures()
+    pop = engine.population
+    assert pop.prob[0] == 1
+    assert pop.prob[1] == engine.config.transmission_prob_close
+    assert pop.infected[1]
+
+
+def test_exposure_keeps_prob_at_most_one():
+    engine = appEngine(2)
+    engine.population.prob[1] = .9
+    engine.exposures.record(np.array([0]), np.array([1]), newTokens(engine.rng, 1))
+    engine.confirm([0])
+    engine._checkExposures()
+    assert engine.population.prob[1] == 1